@@ -0,0 +1,178 @@
+"""
+Benchmarks of the censusclean functions on synthetic census data.
+
+The census files and tract layers are generated for every scale (number of
+census tracts) in a temporary folder, after which every function is timed.
+The growth of the time between two scales is reported as an exponent, which
+is about 1 for functions that scale linearly with the number of tracts, so
+super-linear scaling stands out. Run from the root folder of the repository:
+
+    python benchmarks/run_benchmarks.py --scales 1000 10000 --output bench.json
+"""
+#%% Preamble
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+# The censusclean package is found in the root folder of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import censusclean.censusclean as cc
+from censusclean.data_cleaning_CA import clean_census_ca, reshape_census_CA
+from censusclean.data_cleaning_USA import clean_census_us
+import synthetic
+#%% Functions
+def time_call(function, repeat = 3):
+    """
+    Time a function and return the fastest of multiple runs.
+
+    Parameters
+    ----------
+    function : function
+        Function without arguments.
+    repeat : int, optional
+        Number of runs. The default is 3.
+
+    Returns
+    -------
+    best : float
+        Fastest wall time in seconds.
+    output :
+        Output of the last run.
+
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = function()
+        times.append(time.perf_counter() - start)
+    return min(times), output
+
+def benchmark_scale(n_tracts, n_variables, folder, repeat = 3,
+                    encoding = 'latin-1'):
+    """
+    Generate the data of one scale and time the functions on it.
+
+    Parameters
+    ----------
+    n_tracts : int
+        Number of census tracts.
+    n_variables : int
+        Number of variables in the census files.
+    folder : string
+        Folder in which the synthetic files are written.
+    repeat : int, optional
+        Number of runs of every function. The default is 3.
+    encoding : string, optional
+        Encoding of the census profile of Canada. The default is 'latin-1'.
+
+    Returns
+    -------
+    results : list
+        A dictionary for every function with the scale and the time.
+
+    """
+    file_ca = synthetic.write_statcan_csv(
+        os.path.join(folder, 'profile_%d.csv' % n_tracts), n_tracts,
+        n_variables, encoding = encoding)
+    file_us = synthetic.write_acs_csv(
+        os.path.join(folder, 'acs_%d.csv' % n_tracts), n_tracts, n_variables)
+    tracts = synthetic.tract_polygons(n_tracts)
+    zones = synthetic.zone_polygons(n_tracts)
+    var_oi = synthetic._variable_names(n_variables)
+    # Every benchmark uses the output of the previous ones where needed
+    outputs = {}
+    benchmarks = [
+        ('clean_census_ca', lambda: clean_census_ca(
+            file_ca, 'CHARACTERISTIC_NAME', 'C1_COUNT_TOTAL')),
+        ('reshape_census_CA', lambda: reshape_census_CA(
+            outputs['clean_census_ca'], var_oi)),
+        ('clean_census_us', lambda: clean_census_us(file_us)),
+        ('split_header', lambda: cc.split_header(
+            _header_frame(outputs['clean_census_us']), sep = '!!',
+            id_cols = ['census tract', 'county'])),
+        ('join_by_location', lambda: cc.join_by_location(
+            tracts, zones, col_id = 'NAME10'))
+        ]
+    results = []
+    for name, function in benchmarks:
+        seconds, outputs[name] = time_call(function, repeat)
+        results.append({'function': name, 'tracts': n_tracts,
+                        'variables': n_variables, 'time_s': seconds,
+                        'rows_out': len(outputs[name])})
+        print('%-20s %8d tracts %10.4f s' % (name, n_tracts, seconds))
+    return results
+
+def _header_frame(data):
+    """
+    Rename the variables of a cleaned ACS table to headers of three parts
+    separated by '!!', as input of split_header.
+    """
+    id_cols = ['census tract', 'county']
+    value_cols = [col for col in data.columns if col not in id_cols]
+    names = ['total!!group %d!!%s' % (i % 3, col)
+             for i, col in enumerate(value_cols)]
+    data = data.loc[:,id_cols + value_cols]
+    data.columns = id_cols + names
+    return data
+
+def scaling_exponents(results):
+    """
+    Compute how fast the time grows with the number of tracts.
+
+    The exponent between two successive scales is log(t2/t1)/log(n2/n1):
+    about 1 for linear scaling and 2 for quadratic scaling.
+
+    Parameters
+    ----------
+    results : DataFrame
+        Results with the columns 'function', 'tracts' and 'time_s'.
+
+    Returns
+    -------
+    results : DataFrame
+        Results with an extra column 'exponent', which is missing for the
+        smallest scale.
+
+    """
+    results = results.sort_values(['function', 'tracts'])
+    grouped = results.groupby('function', sort = False)
+    results['exponent'] = (np.log(grouped['time_s'].pct_change() + 1)/
+                           np.log(grouped['tracts'].pct_change() + 1))
+    return results
+
+def main(args = None):
+    """
+    Run the benchmarks from the command line.
+    """
+    parser = argparse.ArgumentParser(
+        description = 'Time the censusclean functions on synthetic data.')
+    parser.add_argument('--scales', type = int, nargs = '+',
+                        default = [1000, 5000, 20000],
+                        help = 'numbers of census tracts')
+    parser.add_argument('--variables', type = int, default = 50,
+                        help = 'number of variables in the census files')
+    parser.add_argument('--repeat', type = int, default = 3,
+                        help = 'number of runs of every function')
+    parser.add_argument('--encoding', default = 'latin-1',
+                        help = 'encoding of the census profile of Canada')
+    parser.add_argument('--output', default = None,
+                        help = 'JSON file to which the results are written')
+    args = parser.parse_args(args)
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for n_tracts in args.scales:
+            results += benchmark_scale(n_tracts, args.variables, folder,
+                                       args.repeat, args.encoding)
+    results = scaling_exponents(pd.DataFrame(results))
+    print(results.to_string(index = False))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results.to_dict(orient = 'records'), f, indent = 1)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
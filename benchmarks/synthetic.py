@@ -0,0 +1,292 @@
+"""
+Generators of synthetic census data for the benchmarks.
+
+The files have the layout of the raw census data used in the project, so the
+cleaning functions can be run on them without the data on the external share:
+
+    - write_statcan_csv: census profile of Statistics Canada, in a long format
+      with a row for every geographical unit and variable.
+    - write_acs_csv: subject table of the American Community Survey, in a
+      wide format with two header rows and a column for every estimate and
+      margin of error.
+    - tract_polygons / zone_polygons: square census tracts on a grid and
+      larger zones (e.g. counties) covering them.
+
+The number of tracts and variables, the encoding and the markers of missing
+values can be set. The same seed gives the same files.
+"""
+#%% Preamble
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+#%% Functions
+def _variable_names(n_variables):
+    """
+    Get names of census variables, with accents as in the French names.
+    """
+    base = ['Population, 2021', '0 to 4 years', '5 to 9 years',
+            '10 to 14 years', '1 person', 'Row house',
+            'Single-detached house', 'Semi-detached house']
+    names = base[:n_variables]
+    names += ['Variable %d - caractéristique' % i
+              for i in range(len(names), n_variables)]
+    return names
+
+def _with_missing(values, na_markers, na_fraction, rng):
+    """
+    Convert values to strings and replace a fraction by missing markers.
+    """
+    values = values.astype(str).astype(object)
+    if len(na_markers) > 0 and na_fraction > 0:
+        missing = rng.random(len(values)) < na_fraction
+        values[missing] = rng.choice(list(na_markers), missing.sum())
+    return values
+
+def statcan_frame(n_tracts, n_variables, na_markers = ('..', 'x', '...'),
+                  na_fraction = 0.05, seed = 0):
+    """
+    Create a census profile of Statistics Canada in a long format.
+
+    Besides the census tracts, the profile contains a row for the country and
+    the census metropolitan area for every variable, as the real file. The
+    variable names are indented with spaces.
+
+    Parameters
+    ----------
+    n_tracts : int
+        Number of census tracts.
+    n_variables : int
+        Number of variables for every geographical unit.
+    na_markers : tuple, optional
+        Markers of missing values. The default is ('..', 'x', '...').
+    na_fraction : float, optional
+        Fraction of the values that is missing. The default is 0.05.
+    seed : int, optional
+        Seed of the random generator. The default is 0.
+
+    Returns
+    -------
+    data : DataFrame
+        The census profile, with all values as strings.
+
+    """
+    rng = np.random.default_rng(seed)
+    # Identifiers of the form 5350001.00 (CMA code and tract number)
+    tract_codes = ['%.2f' % (5350000 + i/100) for i in
+                   range(100, 100 + n_tracts)]
+    geo_codes = ['1', '535'] + tract_codes
+    geo_levels = (['Country', 'Census metropolitan area'] +
+                  ['Census tract']*n_tracts)
+    geo_names = ['Canada', 'Toronto'] + tract_codes
+    n_geo = len(geo_codes)
+    names = _variable_names(n_variables)
+    indent = np.array(['', '  ', '    '])[np.arange(n_variables) % 3]
+    values = rng.integers(0, 5000, n_geo*n_variables)
+    data = pd.DataFrame({
+        'CENSUS_YEAR': 2021,
+        'DGUID': np.repeat(['2021S0507%07d' % i for i in range(n_geo)],
+                           n_variables),
+        'ALT_GEO_CODE': np.repeat(geo_codes, n_variables),
+        'GEO_LEVEL': np.repeat(geo_levels, n_variables),
+        'GEO_NAME': np.repeat(geo_names, n_variables),
+        'TNR_SF': 3.1,
+        'TNR_LF': 2.9,
+        'DATA_QUALITY_FLAG': 0,
+        'CHARACTERISTIC_ID': np.tile(np.arange(1, n_variables + 1), n_geo),
+        'CHARACTERISTIC_NAME': np.tile(np.char.add(indent, names), n_geo),
+        'CHARACTERISTIC_NOTE': '',
+        'C1_COUNT_TOTAL': _with_missing(values, na_markers, na_fraction, rng),
+        'SYMBOL': '',
+        'C2_COUNT_MEN+': _with_missing(values//2, na_markers, na_fraction,
+                                       rng)})
+    return data
+
+def write_statcan_csv(filename, n_tracts, n_variables, encoding = 'latin-1',
+                      na_markers = ('..', 'x', '...'), na_fraction = 0.05,
+                      seed = 0):
+    """
+    Write a census profile of Statistics Canada, see statcan_frame.
+
+    Parameters
+    ----------
+    filename : string
+        Name and path of the file.
+    n_tracts : int
+        Number of census tracts.
+    n_variables : int
+        Number of variables for every geographical unit.
+    encoding : string, optional
+        Encoding of the file. The default is 'latin-1', the encoding of the
+        files of Statistics Canada.
+    na_markers : tuple, optional
+        Markers of missing values. The default is ('..', 'x', '...').
+    na_fraction : float, optional
+        Fraction of the values that is missing. The default is 0.05.
+    seed : int, optional
+        Seed of the random generator. The default is 0.
+
+    Returns
+    -------
+    filename : string
+        Name and path of the file.
+
+    """
+    data = statcan_frame(n_tracts, n_variables, na_markers, na_fraction, seed)
+    data.to_csv(filename, index = False, encoding = encoding)
+    return filename
+
+def acs_frame(n_tracts, n_variables, na_markers = ('-', '(X)'),
+              na_fraction = 0.05, seed = 0):
+    """
+    Create a subject table of the American Community Survey.
+
+    The first row contains the labels of the columns (the second header row
+    of the real file), followed by a row for the state, the counties and the
+    census tracts. Every variable has an estimate and a margin of error.
+
+    Parameters
+    ----------
+    n_tracts : int
+        Number of census tracts.
+    n_variables : int
+        Number of variables.
+    na_markers : tuple, optional
+        Markers of missing values. The default is ('-', '(X)').
+    na_fraction : float, optional
+        Fraction of the values that is missing. The default is 0.05.
+    seed : int, optional
+        Seed of the random generator. The default is 0.
+
+    Returns
+    -------
+    data : DataFrame
+        The subject table with the codes of the columns as header.
+
+    """
+    rng = np.random.default_rng(seed)
+    n_counties = max(1, n_tracts//50)
+    counties = ['County%d' % i for i in range(n_counties)]
+    tract_county = np.arange(n_tracts) % n_counties
+    names = (['Georgia'] + ['%s County, Georgia' % county
+                            for county in counties] +
+             ['Census Tract %d.%02d, %s County, Georgia' %
+              (100 + i//100, i % 100, counties[tract_county[i]])
+              for i in range(n_tracts)])
+    geo_ids = (['0400000US13'] +
+               ['0500000US13%03d' % i for i in range(n_counties)] +
+               ['1400000US13%03d%06d' % (tract_county[i], i)
+                for i in range(n_tracts)])
+    labels = {'GEO_ID': 'Geography', 'NAME': 'Geographic Area Name'}
+    columns = {'GEO_ID': geo_ids, 'NAME': names}
+    groups = ['AGE', 'SELECTED AGE CATEGORIES', 'SUMMARY INDICATORS']
+    for i in range(n_variables):
+        label = 'Total!!Total population!!%s!!Variable %d' % (
+            groups[i % len(groups)], i)
+        values = rng.integers(0, 5000, len(names))
+        for kind, code in [('Estimate', 'E'), ('Margin of Error', 'M')]:
+            column = 'S0101_C01_%03d%s' % (i, code)
+            labels[column] = '%s!!%s' % (kind, label)
+            columns[column] = _with_missing(values, na_markers, na_fraction,
+                                            rng)
+    data = pd.DataFrame(columns)
+    data = pd.concat([pd.DataFrame([labels]), data], ignore_index = True)
+    return data
+
+def write_acs_csv(filename, n_tracts, n_variables, encoding = 'utf-8',
+                  na_markers = ('-', '(X)'), na_fraction = 0.05, seed = 0):
+    """
+    Write a subject table of the American Community Survey, see acs_frame.
+
+    Parameters
+    ----------
+    filename : string
+        Name and path of the file.
+    n_tracts : int
+        Number of census tracts.
+    n_variables : int
+        Number of variables.
+    encoding : string, optional
+        Encoding of the file. The default is 'utf-8'.
+    na_markers : tuple, optional
+        Markers of missing values. The default is ('-', '(X)').
+    na_fraction : float, optional
+        Fraction of the values that is missing. The default is 0.05.
+    seed : int, optional
+        Seed of the random generator. The default is 0.
+
+    Returns
+    -------
+    filename : string
+        Name and path of the file.
+
+    """
+    data = acs_frame(n_tracts, n_variables, na_markers, na_fraction, seed)
+    data.to_csv(filename, index = False, encoding = encoding)
+    return filename
+
+def _grid(n_cells, size, crs):
+    """
+    Create square polygons on a grid with about the same number of rows and
+    columns.
+    """
+    n_cols = int(np.ceil(np.sqrt(n_cells)))
+    x = (np.arange(n_cells) % n_cols)*size
+    y = (np.arange(n_cells)//n_cols)*size
+    return gpd.GeoSeries(shapely.box(x, y, x + size, y + size), crs = crs)
+
+def tract_polygons(n_tracts, size = 1000, crs = 'EPSG:3857'):
+    """
+    Create square census tracts on a grid.
+
+    Parameters
+    ----------
+    n_tracts : int
+        Number of census tracts.
+    size : float, optional
+        Width of a tract in units of the crs. The default is 1000.
+    crs : string, optional
+        Coordinate reference system. The default is 'EPSG:3857'.
+
+    Returns
+    -------
+    tracts : GeoDataFrame
+        Census tracts with an identifier ('CTUID') and a name ('NAMELSAD').
+
+    """
+    geometry = _grid(n_tracts, size, crs)
+    return gpd.GeoDataFrame({
+        'CTUID': ['%.2f' % (5350000 + i/100)
+                  for i in range(100, 100 + n_tracts)],
+        'NAMELSAD': ['Census Tract %d' % i for i in range(n_tracts)]},
+        geometry = geometry)
+
+def zone_polygons(n_tracts, tracts_per_zone = 50, size = 1000,
+                  crs = 'EPSG:3857'):
+    """
+    Create square zones (e.g. counties) covering the tracts of tract_polygons.
+
+    Parameters
+    ----------
+    n_tracts : int
+        Number of census tracts covered.
+    tracts_per_zone : int, optional
+        Approximate number of tracts in a zone. The default is 50.
+    size : float, optional
+        Width of a tract in units of the crs. The default is 1000.
+    crs : string, optional
+        Coordinate reference system. The default is 'EPSG:3857'.
+
+    Returns
+    -------
+    zones : GeoDataFrame
+        Zones with a name ('NAME10').
+
+    """
+    n_cols = int(np.ceil(np.sqrt(n_tracts)))
+    zone_tracts = max(1, int(np.sqrt(tracts_per_zone)))
+    n_zone_cols = int(np.ceil(n_cols/zone_tracts))
+    geometry = _grid(n_zone_cols**2, size*zone_tracts, crs)
+    return gpd.GeoDataFrame({
+        'NAME10': ['Zone%d' % i for i in range(len(geometry))]},
+        geometry = geometry)
@@ -0,0 +1,7 @@
+"""
+Run a census data pipeline from the command line, see censusclean.pipeline.
+"""
+import sys
+from censusclean.pipeline import main
+
+sys.exit(main())
@@ -0,0 +1,224 @@
+"""
+Functions to cache cleaned census data on disk.
+
+The output of the cleaning functions is stored in a columnar format (Parquet
+or Feather), so the raw census files do not have to be parsed again when
+nothing has changed. An entry of the cache is identified by the source file
+(full path, size, modification time and a hash of its first and last
+bytes), the cleaning function and its arguments, and the source code of
+the package, so entries written by older code are not used.
+"""
+#%% Preamble
+import os
+import sys
+import glob
+import hashlib
+from functools import lru_cache
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.feather as feather
+#%% Functions
+# Increase to invalidate all entries, e.g. when the format of the entries
+# changes
+CACHE_VERSION = 1
+
+def file_fingerprint(filename, sample_size = 2**20):
+    """
+    Get a fingerprint of a file which changes when the file changes.
+
+    The fingerprint is a hash of the size and modification time of the file
+    and its first and last bytes, so large files do not have to be read
+    completely.
+
+    Parameters
+    ----------
+    filename : string
+        Name and path of the file.
+    sample_size : int, optional
+        Number of bytes read at the beginning and at the end of the file.
+        The default is 2**20 (1 MiB).
+
+    Returns
+    -------
+    fingerprint : string
+        Hexadecimal hash of the file.
+
+    """
+    file_stat = os.stat(filename)
+    file_hash = hashlib.sha1(('%d-%d' % (file_stat.st_size,
+                                         file_stat.st_mtime_ns)).encode())
+    with open(filename, 'rb') as f:
+        file_hash.update(f.read(sample_size))
+        if file_stat.st_size > 2*sample_size:
+            f.seek(-sample_size, os.SEEK_END)
+            file_hash.update(f.read(sample_size))
+    return file_hash.hexdigest()
+
+def _entry_prefix(clean_function, filename, kwargs):
+    """
+    Get the start of the file name of a cache entry, without the fingerprint.
+    """
+    function_name = '%s.%s' % (clean_function.__module__,
+                               clean_function.__qualname__)
+    arguments = repr(sorted(kwargs.items()))
+    # The full path is part of the key, since the census files of different
+    # cities have the same names
+    argument_hash = hashlib.sha1((os.path.abspath(filename) + function_name +
+                                  arguments).encode())
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return '%s-%s-%s-' % (stem, clean_function.__name__,
+                          argument_hash.hexdigest()[:16])
+
+@lru_cache(maxsize = None)
+def code_fingerprint(module_name):
+    """
+    Get a hash of the code of the censusclean package and of a module.
+
+    The cleaning functions use helper functions across the package, so
+    the source of all its modules is included.
+
+    Parameters
+    ----------
+    module_name : string
+        Name of the module of the cleaning function.
+
+    Returns
+    -------
+    fingerprint : string
+        Hexadecimal hash of the code.
+
+    """
+    filenames = glob.glob(os.path.join(os.path.dirname(
+        os.path.abspath(__file__)), '*.py'))
+    module_file = getattr(sys.modules.get(module_name), '__file__', None)
+    if module_file is not None and module_file.endswith('.py'):
+        filenames.append(os.path.abspath(module_file))
+    code_hash = hashlib.sha1(str(CACHE_VERSION).encode())
+    for filename in sorted(set(filenames)):
+        with open(filename, 'rb') as f:
+            code_hash.update(f.read())
+    return code_hash.hexdigest()
+
+def cached_clean(clean_function, filename, cache_dir = '.censusclean_cache',
+                 max_size = None, file_format = 'parquet', **kwargs):
+    """
+    Clean a census file, using the cached output if nothing has changed.
+
+    When the cache contains an entry for the same file, the same arguments
+    and the same code (see code_fingerprint), it is read from disk. Otherwise the file is cleaned with clean_function,
+    the outdated entries of this file and arguments are removed and the new
+    output is stored in the cache.
+
+    Parameters
+    ----------
+    clean_function : function
+        Function used to clean the file, e.g. clean_census_ca or
+        clean_census_us. The first argument has to be the file name.
+    filename : string
+        Name and path of the census file.
+    cache_dir : string, optional
+        Folder of the cache. The default is '.censusclean_cache'.
+    max_size : int, optional
+        Maximum size of the cache in bytes. When the cache is larger after
+        adding an entry, the least recently used entries are removed. The
+        default is None, which does not limit the size.
+    file_format : string, optional
+        Format of the cache files, 'parquet' or 'feather'. The default is
+        'parquet'.
+    **kwargs :
+        Arguments passed to clean_function (e.g. col_var, col_val, prefix,
+        geo_level_tract). All arguments are part of the key of the entry.
+
+    Returns
+    -------
+    data : DataFrame
+        The cleaned data frame.
+
+    """
+    if file_format not in ['parquet', 'feather']:
+        raise ValueError("file_format has to be 'parquet' or 'feather'.")
+    prefix = _entry_prefix(clean_function, filename, kwargs)
+    # Entries of older versions of the file or the code have the same prefix
+    # and are replaced
+    fingerprint = hashlib.sha1((file_fingerprint(filename) + code_fingerprint(
+        clean_function.__module__)).encode()).hexdigest()[:16]
+    entry = os.path.join(cache_dir, '%s%s.%s' % (prefix, fingerprint,
+                                                 file_format))
+    if os.path.exists(entry):
+        # Update the modification time, which is used to evict entries
+        os.utime(entry)
+        return _read_entry(entry, file_format)
+    data = clean_function(filename, **kwargs)
+    # Remove outdated entries of the same file and arguments
+    os.makedirs(cache_dir, exist_ok = True)
+    for outdated in glob.glob(os.path.join(glob.escape(cache_dir),
+                                           glob.escape(prefix) + '*')):
+        os.remove(outdated)
+    # Write to a temporary file first, so no partial entries are left behind
+    table = pa.Table.from_pandas(data)
+    if file_format == 'parquet':
+        pq.write_table(table, entry + '.tmp')
+    else:
+        feather.write_feather(table, entry + '.tmp')
+    os.replace(entry + '.tmp', entry)
+    if max_size is not None:
+        evict_cache(cache_dir, max_size)
+    return data
+
+def _read_entry(entry, file_format):
+    """
+    Read a cache entry into a data frame.
+    """
+    if file_format == 'parquet':
+        table = pq.read_table(entry)
+    else:
+        table = feather.read_table(entry)
+    return table.to_pandas()
+
+def evict_cache(cache_dir, max_size):
+    """
+    Remove the least recently used entries until the cache is small enough.
+
+    Parameters
+    ----------
+    cache_dir : string
+        Folder of the cache.
+    max_size : int
+        Maximum size of the cache in bytes.
+
+    Returns
+    -------
+    removed : list
+        The removed cache entries.
+
+    """
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+               if name.endswith(('.parquet', '.feather'))]
+    entries.sort(key = os.path.getmtime)
+    cache_size = sum(os.path.getsize(entry) for entry in entries)
+    removed = []
+    while cache_size > max_size and len(entries) > 0:
+        entry = entries.pop(0)
+        cache_size -= os.path.getsize(entry)
+        os.remove(entry)
+        removed.append(entry)
+    return removed
+
+def clear_cache(cache_dir = '.censusclean_cache'):
+    """
+    Remove all entries from the cache.
+
+    Parameters
+    ----------
+    cache_dir : string, optional
+        Folder of the cache. The default is '.censusclean_cache'.
+
+    Returns
+    -------
+    removed : list
+        The removed cache entries.
+
+    """
+    if os.path.isdir(cache_dir) == False:
+        return []
+    return evict_cache(cache_dir, 0)
@@ -10,10 +10,19 @@ Created on Fri Sep  2 15:26:57 2022
 @author: Sander Taragola
 """
 #%% Preamble
+import io
+import glob
+import codecs
+import warnings
 import pandas as pd
+from pandas.api.types import union_categoricals
 import numpy as np
-import geopandas as gpd
+import shapely
+from scipy import sparse
+from censusclean.profiling import instrument
+from censusclean.geometry import reproject
 #%% Functions
+@instrument
 def select_by_prefix(data, prefix, id_cols = None, keep_index = False):
     """
     Select columns based on the prefix of the column names and deletes the prefix afterwards.
@@ -45,10 +54,46 @@ def select_by_prefix(data, prefix, id_cols = None, keep_index = False):
     data_subset = data_subset.reset_index()
     return data_subset
 
+def prefix_columns(prefix, id_cols = None):
+    """
+    Get a function which selects columns based on the prefix of their names.
+
+    The function can be passed as usecols to pd.read_csv, so only the header
+    is checked and the other columns are not parsed at all. This gives the
+    same columns as select_by_prefix, without reading the other columns
+    first.
+
+    Parameters
+    ----------
+    prefix: string
+        The prefix on which the columns are filtered.
+    id_cols: list or string, optional
+        The columns which are always selected. The default is None.
+
+    Returns
+    -------
+    select_col : function
+        Function returning True for the names of the columns to be read.
+
+    """
+    if id_cols is None:
+        id_cols = []
+    elif isinstance(id_cols, list)==False:
+        id_cols = [id_cols]
+    def select_col(col_name):
+        return col_name in id_cols or col_name.startswith(prefix)
+    return select_col
+
+@instrument
 def split_header(data, sep = ' ', id_cols = None):
     """
     Split the header of a data frame where the header is composed of multiple parts.
 
+    The column names are split once and set as a MultiIndex, without
+    reshaping the data. The data is only reshaped to a long format and back
+    when this is needed, i.e. when the names are split in a different number
+    of parts or the identifiers are not unique.
+
     Parameters
     ----------
     data : DataFrame
@@ -63,6 +108,20 @@ def split_header(data, sep = ' ', id_cols = None):
     A data frame whose header is split into 2 variables.
 
     """
+    if isinstance(id_cols, str):
+        id_cols = [id_cols]
+    if id_cols is not None:
+        value_cols = [col for col in data.columns if col not in id_cols]
+        split_names = [col.split(sep) if isinstance(col, str) else None
+                       for col in value_cols]
+        row_index = data.set_index(id_cols).index
+        if (None not in split_names and
+                len(set(len(parts) for parts in split_names)) == 1 and
+                row_index.is_unique and
+                row_index.to_frame().notna().all(axis = None) and
+                pd.Index(value_cols).is_unique):
+            return _split_header_columns(data, value_cols, split_names,
+                                         row_index)
     data_long = data.melt(id_vars = id_cols)
     split_colnames = pd.DataFrame(data_long["variable"]
                                   .str.split(sep, expand = True)
@@ -77,6 +136,125 @@ def split_header(data, sep = ' ', id_cols = None):
                  .reset_index())
     return data_wide
 
+def _split_header_columns(data, value_cols, split_names, row_index):
+    """
+    Set the split column names as a MultiIndex, with the same result as
+    pivoting the long format (a single data type and sorted rows; the columns
+    are only sorted when the names are not split).
+    """
+    n_parts = len(split_names[0]) if len(split_names) > 0 else 1
+    if n_parts == 1:
+        columns = pd.Index(value_cols, name = 'variable0')
+    else:
+        columns = pd.MultiIndex.from_tuples(
+            [tuple(parts) for parts in split_names],
+            names = ['variable%d' % i for i in range(n_parts)])
+    # All values get the common data type, as in the long format
+    values = data.loc[:,value_cols].to_numpy()
+    data_wide = pd.DataFrame(values, index = row_index, columns = columns,
+                             dtype = values.dtype)
+    data_wide = data_wide.sort_index()
+    if n_parts == 1:
+        data_wide = data_wide.sort_index(axis = 1)
+    data_wide = data_wide.reset_index()
+    return data_wide
+
+def _sorted_codes(codes, labels, keep = None):
+    """
+    Recode the codes of pd.factorize to the sorted labels, retaining only the
+    labels where keep is True. The codes of the other labels become -1.
+    """
+    labels = pd.Index(labels)
+    if keep is None:
+        keep = np.ones(len(labels), dtype = bool)
+    kept = np.flatnonzero(keep)
+    # Only the (few) unique labels are sorted
+    kept = kept[labels[kept].argsort()]
+    new_codes = np.full(len(labels) + 1, -1)
+    new_codes[kept] = np.arange(len(kept))
+    # The code -1 (missing value) points to the last element of new_codes
+    return new_codes[codes], np.asarray(labels[kept])
+
+@instrument
+def long_to_wide(data, index, columns, values, keep_columns = None):
+    """
+    Pivot a data frame in long format to a wide format in a single pass.
+
+    The rows and columns of the wide data frame are encoded as categorical
+    codes, after which the values are placed in a preallocated matrix. If a
+    combination of index and columns occurs multiple times, only the first
+    is retained. This gives the same result as removing the duplicates and
+    pivoting the data frame, without creating the intermediate data frames.
+
+    Parameters
+    ----------
+    data : DataFrame
+        Data frame in long format.
+    index : string
+        Name of the column whose values become the rows of the wide data frame.
+    columns : string
+        Name of the column whose values become the columns of the wide data
+        frame.
+    values : string
+        Name of the column containing the values.
+    keep_columns : list, optional
+        Only these values of columns are retained. The default is None, which
+        retains all values.
+
+    Returns
+    -------
+    data_wide : DataFrame
+        Data frame in wide format with index as first column, followed by
+        the sorted values of columns.
+
+    """
+    # Encode the columns, the selection is done on the unique values only
+    if isinstance(data[columns].dtype, pd.CategoricalDtype):
+        # The categories are already encoded (see compact_dtypes)
+        col_codes = data[columns].cat.codes.to_numpy()
+        col_labels = data[columns].cat.categories
+    else:
+        col_codes, col_labels = pd.factorize(data[columns])
+    col_keep = None
+    if keep_columns is not None:
+        col_keep = np.isin(np.asarray(col_labels, dtype = object),
+                           keep_columns)
+    col_codes, col_labels = _sorted_codes(col_codes, col_labels, col_keep)
+    rows = np.flatnonzero(col_codes >= 0)
+    col_codes = col_codes[rows]
+    # Encode the rows, only the retained rows are encoded
+    row_codes, row_labels = _sorted_codes(
+        *pd.factorize(data[index].take(rows)))
+    not_missing = row_codes >= 0
+    rows, row_codes, col_codes = (rows[not_missing], row_codes[not_missing],
+                                  col_codes[not_missing])
+    # Position of the first occurrence of every cell: with repeated cells
+    # the last assignment wins, so the positions are assigned in reverse
+    n_rows, n_cols = len(row_labels), len(col_labels)
+    cells = row_codes * n_cols + col_codes
+    first = np.full(n_rows * n_cols, len(cells))
+    first[cells[::-1]] = np.arange(len(cells))[::-1]
+    filled = first < len(cells)
+    # Scatter the values in the matrix
+    value_col = data[values]
+    if (pd.api.types.is_extension_array_dtype(value_col) and
+            pd.api.types.is_numeric_dtype(value_col)):
+        # Nullable integers, missing values become NaN
+        value_array = value_col.to_numpy(dtype = float, na_value = np.nan)[rows]
+    else:
+        value_array = value_col.to_numpy()[rows]
+    if filled.all():
+        matrix = np.empty(n_rows * n_cols, dtype = value_array.dtype)
+    else:
+        matrix = np.full(n_rows * n_cols, np.nan,
+                         dtype = np.result_type(value_array.dtype, float))
+    matrix[filled] = value_array[first[filled]]
+    data_wide = pd.DataFrame(matrix.reshape(n_rows, n_cols),
+                             index = pd.Index(row_labels, name = index),
+                             columns = pd.Index(col_labels, name = columns))
+    return data_wide.reset_index()
+
+@instrument
 def extract_part(data, col_id, new_id = 'extracted', separators = ' ', locations = 0):
     """
     Extract a specific part of a string into a dataframe column based on separators.
@@ -115,6 +293,42 @@ def extract_part(data, col_id, new_id = 'extracted', separators = ' ', locations
     data[new_id] = col_extract
     return data
 
+@instrument
+def extract_groups(data, col_id, pattern, new_ids = None):
+    """
+    Extract multiple parts of a string into dataframe columns at once.
+
+    The parts are given by the named groups of a regular expression, which
+    is applied to all strings in a single pass.
+
+    Parameters
+    ----------
+    data : DataFrame
+        The dataframe with a column of strings.
+    col_id : string
+        Name of the column containing the full strings.
+    pattern : string or compiled regular expression
+        Regular expression with a named group for every part.
+    new_ids : dict, optional
+        Names of the columns that will be added to data for the groups that
+        are needed, e.g. {'tract': 'Census Tract'}. The default is None, in
+        which case a column is added for every group, named after the group.
+
+    Returns
+    -------
+    data : DataFrame
+        Input data frame with an extra column for every extracted part.
+        Strings that do not match the pattern result in missing values.
+
+    """
+    col_extract = data[col_id].str.extract(pattern, expand = True)
+    if new_ids is None:
+        new_ids = {group: group for group in col_extract.columns}
+    for group, new_id in new_ids.items():
+        data[new_id] = col_extract[group].str.strip()
+    return data
+
+@instrument
 def set_format_colnames(data, sep = '_',
                         manually_name = None, manually_location = None):
     """
@@ -158,21 +372,359 @@ def set_format_colnames(data, sep = '_',
     data.columns = col_names
     return data
 
-def get_encoding(filename):
+def _compact_column(col, max_unique_ratio):
+    """
+    Convert a column to the most compact dtype that keeps all values.
+    """
+    if (isinstance(col.dtype, pd.CategoricalDtype) or
+            pd.api.types.is_bool_dtype(col)):
+        return col
+    if pd.api.types.is_object_dtype(col) or pd.api.types.is_string_dtype(col):
+        if col.nunique() <= max_unique_ratio*len(col):
+            return col.astype('category')
+        return col
+    if pd.api.types.is_numeric_dtype(col) == False:
+        return col
+    values = col.to_numpy(dtype = float, na_value = np.nan)
+    has_na = np.isnan(values).any()
+    values = values[np.isnan(values) == False]
+    if len(values) == 0:
+        return col
+    if (np.mod(values, 1) == 0).all() and np.abs(values).max() < 2**53:
+        # Counts are stored as the smallest integer type, with a mask for
+        # missing values if needed
+        for dtype in [np.int8, np.int16, np.int32, np.int64]:
+            if (np.iinfo(dtype).min <= values.min() and
+                    values.max() <= np.iinfo(dtype).max):
+                break
+        if has_na:
+            return col.astype(np.dtype(dtype).name.capitalize())
+        return col.astype(dtype)
+    if (values.astype(np.float32).astype(float) == values).all():
+        return col.astype(np.float32)
+    return col
+
+@instrument
+def compact_dtypes(data, max_unique_ratio = 0.5, verbose = False):
+    """
+    Convert the columns of a data frame to compact dtypes.
+
+    Text columns with many repeated values (e.g. tract identifiers or
+    variable names in a long format) are converted to categoricals. Numeric
+    columns containing only whole numbers are converted to the smallest
+    integer type that holds all values, using a nullable integer type if
+    values are missing. Other numeric columns are converted to float32 if
+    this does not change any value.
+
+    Parameters
+    ----------
+    data : DataFrame
+        The data frame to be converted.
+    max_unique_ratio : float, optional
+        Text columns are converted to categoricals if the number of unique
+        values is at most this share of the number of rows. The default is
+        0.5.
+    verbose : boolean, optional
+        Print the dtypes and memory use of the columns before and after the
+        conversion. The default is False.
+
+    Returns
+    -------
+    data_compact : DataFrame
+        Data frame with compact dtypes.
+
+    """
+    data_compact = data.copy(deep = False)
+    for col in data.columns:
+        data_compact[col] = _compact_column(data[col], max_unique_ratio)
+    if verbose:
+        report = pd.DataFrame({'dtype before': data.dtypes.astype(str),
+                               'dtype after': data_compact.dtypes.astype(str),
+                               'MB before': data.memory_usage(
+                                   deep = True, index = False)/1e6,
+                               'MB after': data_compact.memory_usage(
+                                   deep = True, index = False)/1e6})
+        report.loc['total'] = ['', '', report['MB before'].sum(),
+                               report['MB after'].sum()]
+        print(report.round(3).to_string())
+    return data_compact
+
+def concat_categorical(data_parts):
+    """
+    Concatenate data frames, keeping the categorical columns categorical.
+
+    pd.concat converts categorical columns with different categories to
+    text. Here the categories of every column are combined first.
+
+    Parameters
+    ----------
+    data_parts : list
+        Data frames with the same columns.
+
+    Returns
+    -------
+    data : DataFrame
+        The concatenated data frame.
+
+    """
+    columns = data_parts[0].columns
+    cat_cols = [col for col in columns
+                if any(isinstance(part[col].dtype, pd.CategoricalDtype)
+                       for part in data_parts)]
+    categoricals = {col: union_categoricals([part[col].astype('category')
+                                             for part in data_parts])
+                    for col in cat_cols}
+    data = pd.concat([part.drop(columns = cat_cols) for part in data_parts])
+    for col in cat_cols:
+        data[col] = categoricals[col]
+    return data.loc[:,columns]
+
+@instrument
+def merge_tables(tables, on, how = 'outer', verbose = False):
+    """
+    Merge multiple tables on the same key columns in a single join.
+
+    The key columns are set as index of every table once, after which all
+    tables are aligned on the keys of the result and combined in one concat.
+    This gives the same rows as a chain of merges, without copying the
+    growing result at every merge. The keys have to be unique in every
+    table, since duplicate keys would multiply the rows of the result.
+
+    Parameters
+    ----------
+    tables : list
+        Data frames which all contain the key columns.
+    on : list or string
+        Names of the key columns, e.g. ['census tract', 'county'].
+    how : string, optional
+        'outer' keeps the keys of all tables (sorted, as merge does), 'inner'
+        the keys found in every table and 'left' the keys of the first table,
+        both in the order of the first table. The default is 'outer'.
+    verbose : boolean, optional
+        Print for every table the number of rows, the number of its keys that
+        are missing in at least one other table, the number of its rows that
+        are not in the result and the number of keys of the result it has no
+        values for. The default is False.
+
+    Returns
+    -------
+    data_merged : DataFrame
+        The merged tables, with the key columns first. Other columns with the
+        same name in multiple tables get the position of their table as
+        suffix (e.g. '_0', '_1').
+
+    """
+    if isinstance(on, list)==False:
+        on = [on]
+    if how not in ['outer', 'inner', 'left']:
+        raise ValueError("how has to be 'outer', 'inner' or 'left'.")
+    tables = [table.set_index(on) for table in tables]
+    for i, table in enumerate(tables):
+        duplicated = table.index.duplicated(keep = False)
+        if duplicated.any():
+            raise ValueError('Table %d contains %d rows with duplicate keys, '
+                             'e.g. %s.' % (i, duplicated.sum(),
+                                           table.index[duplicated][0]))
+    # Keys of the result
+    if how == 'left':
+        keys = tables[0].index
+    elif how == 'inner':
+        keys = tables[0].index
+        for table in tables[1:]:
+            keys = keys[keys.isin(table.index)]
+    else:
+        keys = tables[0].index
+        for table in tables[1:]:
+            keys = keys.append(table.index[table.index.isin(keys) == False])
+        keys = keys.sort_values()
+    # Columns occurring in multiple tables get a suffix
+    col_count = pd.Series([col for table in tables
+                           for col in table.columns]).value_counts()
+    aligned = []
+    for i, table in enumerate(tables):
+        table = table.reindex(keys)
+        table.columns = [col if col_count[col] == 1 else '%s_%d' % (col, i)
+                         for col in table.columns]
+        aligned.append(table)
+    data_merged = pd.concat(aligned, axis = 1).reset_index()
+    if verbose:
+        report = pd.DataFrame({
+            'rows': [len(table) for table in tables],
+            'unmatched keys': [_unmatched_keys(tables, i)
+                               for i in range(len(tables))],
+            'dropped rows': [(table.index.isin(keys) == False).sum()
+                             for table in tables],
+            'missing keys': [(keys.isin(table.index) == False).sum()
+                             for table in tables]})
+        report.index.name = 'table'
+        print(report.to_string())
+    return data_merged
+
+def _unmatched_keys(tables, i):
+    """
+    Count the keys of a table that are missing in at least one other table.
+    """
+    matched = np.ones(len(tables[i]), dtype = bool)
+    for j, other in enumerate(tables):
+        if j != i:
+            matched &= tables[i].index.isin(other.index)
+    return (matched == False).sum()
+
+def detect_encoding(sample):
+    """
+    Detect the encoding of a text based on its first bytes.
+
+    A byte order mark (BOM) is used if present. Otherwise the text is UTF-8
+    if the bytes are valid UTF-8, Windows-1252 if they are valid Windows-1252
+    and latin-1 (which accepts all bytes) if not.
+
+    Parameters
+    ----------
+    sample : bytes
+        The first bytes of the text.
+
+    Returns
+    -------
+    encoding : string
+        Name of the codec.
+
+    """
+    # UTF-32 is checked before UTF-16, since their little endian BOMs overlap
+    boms = [(codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'),
+            (codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'),
+            (codecs.BOM_UTF16_BE, 'utf-16')]
+    for bom, encoding in boms:
+        if sample.startswith(bom):
+            return encoding
+    for encoding in ['utf-8', 'cp1252']:
+        try:
+            # The sample can end in the middle of a multibyte character
+            decoder = codecs.getincrementaldecoder(encoding)()
+            decoder.decode(sample, final = False)
+            return encoding
+        except UnicodeDecodeError:
+            pass
+    return 'latin-1'
+
+def _encoding_sample(binary_file, sample_size = 2**16, max_samples = 16):
+    """
+    Read the bytes of a file used to detect its encoding.
+
+    ASCII bytes are valid in all candidate encodings, so when the first bytes
+    are ASCII the file is read further, up to its first non-ASCII byte, but
+    at most max_samples times sample_size bytes (1 MiB by default), so large
+    files are not read twice. The sample then starts at that byte. If no
+    non-ASCII byte is found, the ASCII sample is returned and the file is
+    decoded as UTF-8, which raises an error if it is not. The position of
+    the file is not reset.
+    """
+    sample = binary_file.read(sample_size)
+    for _ in range(max_samples - 1):
+        if sample.isascii() == False:
+            break
+        chunk = binary_file.read(sample_size)
+        if len(chunk) == 0:
+            # The whole file is ASCII
+            break
+        if chunk.isascii() == False:
+            start = len(chunk) - len(chunk.lstrip(bytes(range(128))))
+            # Read on, so a multibyte character is not cut off
+            return chunk[start:] + binary_file.read(sample_size)
+        sample = chunk
+    return sample
+
+def open_text(filename, sample_size = 2**16, errors = 'strict'):
+    """
+    Open a text file with the encoding detected from its bytes.
+
+    The file is opened once in binary mode. The first bytes, or the first
+    non-ASCII bytes within the first MiB if the file starts with ASCII text,
+    are used to detect the encoding, after which the same file object is
+    decoded as a text stream.
+
+    Parameters
+    ----------
+    filename : string
+        Name and path of the file.
+    sample_size : int, optional
+        Number of bytes used to detect the encoding. The default is 2**16.
+    errors : string, optional
+        How decoding errors further in the file are handled. The default is
+        'strict', which raises an error when the detected encoding is wrong.
+
+    Returns
+    -------
+    text_file : TextIOWrapper
+        The opened text file, with the detected codec as encoding attribute.
+
+    """
+    binary_file = open(filename, 'rb')
+    encoding = detect_encoding(_encoding_sample(binary_file, sample_size))
+    binary_file.seek(0)
+    return io.TextIOWrapper(binary_file, encoding = encoding, errors = errors,
+                            newline = '')
+
+def get_encoding(filename, sample_size = 2**16):
     """
     Get file encoding.
+
+    The encoding is detected from the first (non-ASCII) bytes of the file,
+    see detect_encoding.
+    """
+    with open(filename, 'rb') as f:
+        return detect_encoding(_encoding_sample(f, sample_size))
+
+def read_csv_partitioned(filenames, **kwargs):
+    """
+    Read one or multiple csv files lazily as a dask data frame.
+
+    Every file becomes one partition (e.g. one file per province or state),
+    so the partitions are read and processed in parallel by the active dask
+    scheduler. With a distributed scheduler, partitions that do not fit in
+    memory are spilled to disk. The encoding is detected from the first file.
+
+    Parameters
+    ----------
+    filenames : string or list
+        Name and path of the files, or a pattern such as 'data/*.csv'.
+    **kwargs :
+        Arguments passed to pandas.read_csv for every file.
+
+    Returns
+    -------
+    data : dask DataFrame
+        The lazily read files.
+
     """
-    with open(filename) as f:
-        return f.encoding
+    try:
+        import dask.dataframe as dd
+    except ImportError:
+        raise ImportError("The dask backend requires dask, install it with "
+                          "pip install 'dask[dataframe]'.")
+    if isinstance(filenames, list) == False:
+        filenames = sorted(glob.glob(filenames)) or [filenames]
+    kwargs.setdefault('encoding', get_encoding(filenames[0]))
+    return dd.read_csv(filenames, blocksize = None, **kwargs)
 
+def _check_backend(backend):
+    """
+    Check the name of a backend.
+    """
+    if backend not in ['pandas', 'dask']:
+        raise ValueError("backend has to be 'pandas' or 'dask'.")
+
+@instrument
 def join_by_location(layer_1, layer_2, col_id,
-                            lsuffix = 'x', rsuffix = 'y'):
+                            lsuffix = 'x', rsuffix = 'y',
+                            sampling = 'centroid'):
     """
     Add columns from layer_2 to layer_1 based on overlaps.
     
     Spatially join both layers one-to-one. The feature of layer_2 of which 
-    the attribute is used is the feature that contains the centroid of 
-    layer_1's feature.
+    the attribute is used is the feature that contains the centroid (or 
+    another point inside) of layer_1's feature. The polygons of layer_2 are 
+    prepared and stored in a spatial index (STRtree), which is queried for 
+    all points at once.
 
     Parameters
     ----------
@@ -189,6 +741,11 @@ def join_by_location(layer_1, layer_2, col_id,
     rsuffix : string, optional
         suffix added to the column names of layer_2, which are also 
         present in layer_1. The default is 'y'.
+    sampling : string, optional
+        Point of the features of layer_1 used to sample layer_2. Either
+        'centroid' or 'representative_point'. The centroid of a concave 
+        polygon can fall outside the polygon, a representative point is 
+        always inside. The default is 'centroid'.
 
     Returns
     -------
@@ -196,15 +753,303 @@ def join_by_location(layer_1, layer_2, col_id,
         Joined GeoDataFrame.
 
     """
-    layer_2 = layer_2.to_crs(layer_1.crs)
     if isinstance(col_id, list)==False:
         col_id = [col_id]
-    layer_2 = layer_2.loc[:,['geometry']+col_id]
-    # Use centroids to join layers one-to-one
-    samplers = layer_1.copy()
-    samplers.geometry = layer_1.geometry.centroid
-    samplers = gpd.sjoin(samplers, layer_2, 
-                     how = 'left', lsuffix=lsuffix, rsuffix=rsuffix)
-    samplers.geometry = layer_1.geometry
-    output_layer = samplers.copy()
-    return output_layer
\ No newline at end of file
+    # Only the geometries are reprojected, the layer is not copied
+    targets = np.asarray(layer_2.geometry.values)
+    if layer_2.crs != layer_1.crs:
+        targets = reproject(targets, layer_2.crs, layer_1.crs)
+    # Use points to join layers one-to-one
+    if sampling == 'centroid':
+        samplers = layer_1.geometry.centroid.values
+    elif sampling == 'representative_point':
+        samplers = layer_1.geometry.representative_point().values
+    else:
+        raise ValueError("sampling has to be 'centroid' or "
+                         "'representative_point'.")
+    shapely.prepare(targets)
+    tree = shapely.STRtree(targets)
+    sampler_idx, target_idx = tree.query(np.asarray(samplers),
+                                         predicate = 'intersects')
+    # Keep the features of layer_1 without a match (left join)
+    unmatched = np.setdiff1d(np.arange(len(layer_1)), sampler_idx)
+    sampler_idx = np.concatenate([sampler_idx, unmatched])
+    target_idx = np.concatenate([target_idx,
+                                 np.full(len(unmatched), -1, dtype = int)])
+    order = np.lexsort((target_idx, sampler_idx))
+    sampler_idx, target_idx = sampler_idx[order], target_idx[order]
+    # Attributes of layer_2, the position -1 results in missing values
+    attributes = pd.DataFrame(layer_2.loc[:,col_id])
+    attributes.insert(0, 'index_' + rsuffix, layer_2.index)
+    attributes = attributes.reset_index(drop = True).reindex(target_idx)
+    overlap = layer_1.columns.intersection(attributes.columns)
+    attributes = attributes.rename(columns = {col: col + '_' + rsuffix
+                                              for col in overlap})
+    output_layer = layer_1.iloc[sampler_idx].rename(
+        columns = {col: col + '_' + lsuffix for col in overlap})
+    for col in attributes.columns:
+        output_layer[col] = attributes[col].to_numpy()
+    return output_layer
+
+@instrument
+def assign_city(layer, cities, name_col, new_id = 'city',
+                sampling = 'representative_point', names = None):
+    """
+    Assign the features of a layer to the cities they are located in.
+
+    This allows to read a national or state-wide layer once and to split it
+    for all cities at the same time. The features outside the bounding box of
+    all cities are removed first. For the remaining features, a point inside
+    the feature is tested against the prepared city boundaries, stored in a
+    spatial index.
+
+    Parameters
+    ----------
+    layer : GeoDataFrame
+        A GeoDataFrame with polygons as geometries, e.g. census tracts.
+    cities : GeoDataFrame
+        A GeoDataFrame with the boundaries of the cities.
+    name_col : string
+        Name of the column of cities containing the names of the cities.
+    new_id : string, optional
+        Name of the column that will be added with the name of the city. The
+        default is 'city'.
+    sampling : string, optional
+        Point of the features used to test the location. Either 'centroid' or
+        'representative_point'. The default is 'representative_point'.
+    names : list, optional
+        Names of the cities that are used, e.g. when cities contains all
+        metropolitan areas of a country. The default is None, which uses all
+        cities.
+
+    Returns
+    -------
+    output_layer : GeoDataFrame
+        The features located in a city, with the name of the city. A feature
+        located in multiple (overlapping) cities is repeated for each city.
+
+    """
+    if names is not None:
+        cities = cities.loc[cities[name_col].isin(names)]
+    if cities.crs != layer.crs:
+        cities = cities.to_crs(layer.crs)
+    # Bounding box prefilter
+    xmin, ymin, xmax, ymax = cities.total_bounds
+    geoms = np.asarray(layer.geometry.values)
+    bounds = shapely.bounds(geoms)
+    candidates = np.flatnonzero((bounds[:,0] <= xmax) & (bounds[:,2] >= xmin) &
+                                (bounds[:,1] <= ymax) & (bounds[:,3] >= ymin))
+    if sampling == 'centroid':
+        samplers = shapely.centroid(geoms[candidates])
+    elif sampling == 'representative_point':
+        samplers = shapely.point_on_surface(geoms[candidates])
+    else:
+        raise ValueError("sampling has to be 'centroid' or "
+                         "'representative_point'.")
+    boundaries = np.asarray(cities.geometry.values)
+    shapely.prepare(boundaries)
+    tree = shapely.STRtree(boundaries)
+    sampler_idx, city_idx = tree.query(samplers, predicate = 'intersects')
+    order = np.lexsort((city_idx, sampler_idx))
+    sampler_idx, city_idx = sampler_idx[order], city_idx[order]
+    output_layer = layer.iloc[candidates[sampler_idx]].copy()
+    output_layer[new_id] = cities[name_col].to_numpy()[city_idx]
+    return output_layer
+
+@instrument
+def split_by_city(layer, cities, name_col, sampling = 'representative_point',
+                  names = None):
+    """
+    Split a layer into a layer for every city.
+
+    See assign_city for the assignment of the features to the cities.
+
+    Parameters
+    ----------
+    layer : GeoDataFrame
+        A GeoDataFrame with polygons as geometries, e.g. census tracts.
+    cities : GeoDataFrame
+        A GeoDataFrame with the boundaries of the cities.
+    name_col : string
+        Name of the column of cities containing the names of the cities.
+    sampling : string, optional
+        Point of the features used to test the location. Either 'centroid' or
+        'representative_point'. The default is 'representative_point'.
+    names : list, optional
+        Names of the cities that are used. The default is None, which uses all
+        cities.
+
+    Returns
+    -------
+    city_layers : dict
+        The layer of every city, with the name of the city as key. Cities
+        without features are not included.
+
+    """
+    assigned = assign_city(layer, cities, name_col, '__city__', sampling,
+                           names)
+    city_layers = {city: city_layer.drop(columns = '__city__')
+                   for city, city_layer in assigned.groupby('__city__',
+                                                            sort = False)}
+    return city_layers
+
+@instrument
+def partition_by_city(data, assigned, left_on, right_on = None,
+                      new_id = 'city'):
+    """
+    Partition a census table by city, using the tracts assigned to cities.
+
+    The census table of a whole country or state is cleaned once, after
+    which the rows of the tracts located in a city (see assign_city) are
+    kept and get the name of their city. The rows of a tract located in
+    multiple cities are repeated for each city.
+
+    Parameters
+    ----------
+    data : DataFrame
+        Census table with a column with the tract identifiers.
+    assigned : DataFrame
+        Tracts assigned to cities, e.g. the output of assign_city.
+    left_on : string
+        Name of the column of data containing the tract identifiers.
+    right_on : string, optional
+        Name of the column of assigned containing the tract identifiers. The
+        default is None, in which case left_on is used.
+    new_id : string, optional
+        Name of the column of assigned containing the name of the city. The
+        default is 'city'.
+
+    Returns
+    -------
+    data_cities : DataFrame
+        The rows of the tracts located in a city, with the name of the city.
+
+    """
+    if right_on is None:
+        right_on = left_on
+    tract_cities = pd.DataFrame({
+        '__tract__': assigned[right_on].to_numpy(),
+        new_id: assigned[new_id].to_numpy()}).drop_duplicates()
+    data_cities = data.merge(tract_cities, how = 'inner', left_on = left_on,
+                             right_on = '__tract__', sort = False)
+    return data_cities.drop(columns = '__tract__')
+
+@instrument
+def overlap_areas(source, target, return_source_area = False):
+    """
+    Compute the areas of overlap between the features of two layers.
+
+    The intersections are only computed for the pairs of features whose
+    bounding boxes overlap, found with a spatial index. The result is stored
+    in a sparse matrix, so it can be reused to interpolate any number of
+    attributes with interpolate_areal. The areas of the source features,
+    needed for extensive attributes, can be returned as well, so the source
+    layer is only reprojected once.
+
+    Parameters
+    ----------
+    source : GeoDataFrame
+        A GeoDataFrame with polygons as geometries. This is the layer of
+        which the attributes are interpolated.
+    target : GeoDataFrame
+        A GeoDataFrame with polygons as geometries. This is the layer to
+        which the attributes are interpolated. The areas are computed in the
+        CRS of this layer, which should therefore be projected.
+    return_source_area : boolean, optional
+        Also return the areas of the source features. The default is False.
+
+    Returns
+    -------
+    overlaps : csr_matrix
+        Sparse matrix with a row for every feature of target and a column for
+        every feature of source, containing the areas of overlap.
+    source_area : ndarray
+        Areas of the source features in the CRS of target, only returned if
+        return_source_area is True.
+
+    """
+    if target.crs is not None and target.crs.is_geographic:
+        warnings.warn('The CRS of target is geographic, the areas of overlap'
+                      ' are computed in degrees instead of a projected unit.')
+    source_geom = np.asarray(source.geometry.values)
+    if source.crs != target.crs:
+        source_geom = reproject(source_geom, source.crs, target.crs)
+    target_geom = np.asarray(target.geometry.values)
+    tree = shapely.STRtree(source_geom)
+    target_idx, source_idx = tree.query(target_geom, predicate = 'intersects')
+    areas = shapely.area(shapely.intersection(target_geom[target_idx],
+                                              source_geom[source_idx]))
+    overlaps = sparse.csr_matrix((areas, (target_idx, source_idx)),
+                                 shape = (len(target_geom), len(source_geom)))
+    overlaps.eliminate_zeros()
+    if return_source_area:
+        return overlaps, shapely.area(source_geom)
+    return overlaps
+
+@instrument
+def interpolate_areal(overlaps, source, target, col_id, extensive = True,
+                      source_area = None):
+    """
+    Add columns from source to target by area weighted interpolation.
+
+    For extensive variables (e.g. counts), every feature of target gets the
+    part of the value of source that corresponds to the part of the area of
+    the source feature that it covers. For intensive variables (e.g. rates
+    or medians), every feature of target gets the mean of the values of
+    source weighted by the areas of overlap. Missing values are left out of
+    the weights. All columns are interpolated at once as a sparse matrix
+    product.
+
+    Parameters
+    ----------
+    overlaps : csr_matrix
+        Areas of overlap between target (rows) and source (columns), see
+        overlap_areas.
+    source : GeoDataFrame
+        A GeoDataFrame with polygons as geometries. This is the layer of
+        which the attributes are interpolated.
+    target : GeoDataFrame
+        A GeoDataFrame with polygons as geometries. This is the base layer.
+    col_id : string
+        The column names of the attributes of source.
+    extensive : boolean, optional
+        Are the attributes extensive (True) or intensive (False). The default
+        is True.
+    source_area : ndarray, optional
+        Areas of the source features in the CRS of target, see overlap_areas.
+        The default is None, in which case they are computed from source.
+
+    Returns
+    -------
+    output_layer : GeoDataFrame
+        Target layer with the interpolated columns.
+
+    """
+    if isinstance(col_id, list)==False:
+        col_id = [col_id]
+    values = source.loc[:,col_id].to_numpy(dtype = float)
+    available = np.isnan(values) == False
+    if extensive:
+        # Share of the area of every source feature, in the CRS of target
+        if source_area is None:
+            source_geom = np.asarray(source.geometry.values)
+            if source.crs != target.crs:
+                source_geom = reproject(source_geom, source.crs, target.crs)
+            source_area = shapely.area(source_geom)
+        with np.errstate(divide = 'ignore'):
+            scale = np.where(source_area > 0, 1/source_area, 0)
+        weights = overlaps @ sparse.diags(scale)
+    else:
+        weights = overlaps
+    weighted_sum = weights @ np.where(available, values, 0)
+    weight_total = weights @ available.astype(float)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        if extensive:
+            # Features without any available value are missing
+            interpolated = np.where(weight_total > 0, weighted_sum, np.nan)
+        else:
+            interpolated = weighted_sum/weight_total
+    output_layer = target.copy()
+    for i, col in enumerate(col_id):
+        output_layer[col] = interpolated[:,i]
+    return output_layer
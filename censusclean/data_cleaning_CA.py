@@ -4,10 +4,15 @@ Functions to simplify the cleaning of Canadian census data.
 #%% Preamble
 # load packages
 import pandas as pd
+import numpy as np
 import censusclean.censusclean as cc
+from censusclean.profiling import instrument, section
 #%% Load data
 # Load census data
-def clean_census_ca(filename, col_var, col_val, geo_level_tract = 'Census tract'):
+@instrument
+def clean_census_ca(filename, col_var, col_val, geo_level_tract = 'Census tract',
+                    var_oi = None, chunksize = None, compact = False,
+                    backend = 'pandas'):
     """
     Clean census data of Canada.
 
@@ -18,13 +23,32 @@ def clean_census_ca(filename, col_var, col_val, geo_level_tract = 'Census tract'
     Parameters
     ----------
     filename : string
-        Name and path of the census file.
+        Name and path of the census file. With the dask backend, this can
+        also be a list of files or a pattern (e.g. one file per province).
     col_var : string
         Name of the column containing the variable names.
     col_val : string
         Name of the column containing the values.
     geo_level_tract : string or double, optional.
         Value which indicates census tract. The default is 'Census tract'.
+    var_oi : list, optional
+        Variables of interest. When given, only the rows of these variables
+        are retained. The default is None, which keeps all variables.
+    chunksize : int, optional
+        Number of rows read at once. When given, the file is streamed in
+        chunks and every chunk is reduced to the needed columns, the census
+        tracts and the variables of interest before the next one is read, so
+        the memory use depends on the chunk size instead of the file size.
+        The default is None, which reads the file at once.
+    compact : boolean, optional
+        Store the text columns as categoricals (already while reading the
+        chunks) and the values in the smallest numeric type that keeps all
+        values, see cc.compact_dtypes. The default is False.
+    backend : string, optional
+        'pandas' or 'dask'. With 'dask', every file is a partition which is
+        read and reduced in parallel (see cc.read_csv_partitioned), after
+        which the reduced data is collected in a pandas data frame. The
+        default is 'pandas'.
 
     Returns
     -------
@@ -32,38 +56,170 @@ def clean_census_ca(filename, col_var, col_val, geo_level_tract = 'Census tract'
         The cleaned data frame.
 
     """
+    cc._check_backend(backend)
     # Read file
-    data = pd.read_csv(filename,
-                       encoding=cc.get_encoding(filename), sep = ',',
-                       na_values=['...','..','x','NaN'],
-                       low_memory=False, encoding_errors= 'ignore')
-    # Clean data
+    def select_col(col_name):
+        # Columns containing geographical information, variables and values
+        return 'GEO' in col_name or col_name in [col_var, col_val]
+    read_options = dict(sep = ',', na_values=['...','..','x','NaN'],
+                        usecols = select_col,
+                        dtype = {'GEO_NAME': str, col_var: str},
+                        low_memory=False)
+    if backend == 'dask':
+        import dask
+        # The identifiers are read as text, since their numeric type can
+        # differ between the files
+        read_options['dtype']['ALT_GEO_CODE'] = str
+        data = cc.read_csv_partitioned(filename, **read_options)
+        # The check for points is done over the entire dataset
+        has_point = data.ALT_GEO_CODE.map_partitions(
+            lambda codes: pd.Series([_contains_point(codes.unique())]),
+            meta = ('ALT_GEO_CODE', bool)).any()
+        data['ALT_GEO_CODE'] = data.ALT_GEO_CODE.astype(float)
+        data = data.map_partitions(_clean_chunk, col_var, col_val,
+                                   geo_level_tract, var_oi, False)
+        data, has_point = dask.compute(data, has_point)
+        # The row numbers restart in every file
+        data = data.reset_index(drop = True)
+        return _format_census_ca([data], has_point, col_var, col_val,
+                                 compact)
+    # The file is opened once, with the encoding detected from the first bytes
+    with cc.open_text(filename) as census_file:
+        if chunksize is None:
+            with section('read_csv'):
+                data = [pd.read_csv(census_file, **read_options)]
+        else:
+            data = _timed_chunks(pd.read_csv(census_file,
+                                             chunksize = chunksize,
+                                             **read_options))
+        # Clean data
+        data_parts = []
+        has_point = False
+        for data_chunk in data:
+            # The check for points is done over the entire dataset
+            has_point = (has_point or
+                         _contains_point(data_chunk.ALT_GEO_CODE.unique()))
+            data_parts.append(_clean_chunk(data_chunk, col_var, col_val,
+                                           geo_level_tract, var_oi, compact))
+    return _format_census_ca(data_parts, has_point, col_var, col_val, compact)
+
+def _timed_chunks(chunks):
+    """
+    Yield the chunks of a csv reader, recording the reading of every chunk
+    (not the cleaning) as 'read_csv' in the active Profiler.
+    """
+    chunks = iter(chunks)
+    while True:
+        with section('read_csv'):
+            data_chunk = next(chunks, None)
+        if data_chunk is None:
+            return
+        yield data_chunk
+
+def _clean_chunk(data_chunk, col_var, col_val, geo_level_tract, var_oi,
+                 compact):
+    """
+    Reduce a chunk of the census file to the census tracts and the variables
+    of interest.
+    """
+    # Only keep census tract data, in a copy since columns are assigned to it
+    data_chunk = data_chunk.loc[data_chunk['GEO_LEVEL']==
+                                geo_level_tract].copy()
+    # Strip spaces from variable names
+    data_chunk[col_var] = data_chunk[col_var].str.strip()
+    # Only keep the variables of interest
+    if var_oi is not None:
+        data_chunk = data_chunk.loc[data_chunk[col_var].isin(var_oi)].copy()
+    data_chunk[col_val] = pd.to_numeric(data_chunk[col_val],
+                                        errors = 'coerce')
+    if compact:
+        # Text columns are stored once per unique value
+        text_cols = [col for col in data_chunk.columns
+                     if col != 'ALT_GEO_CODE' and
+                     pd.api.types.is_numeric_dtype(data_chunk[col])
+                     == False]
+        data_chunk = data_chunk.astype({col: 'category'
+                                        for col in text_cols})
+    return data_chunk
+
+def _format_census_ca(data_parts, has_point, col_var, col_val, compact):
+    """
+    Combine the cleaned chunks and set the identifiers and column names.
+    """
+    data_output = cc.concat_categorical(data_parts)
     # Set ALT_GEO_CODE to string type with format (length: 10, decimals: 2)
-    if data.ALT_GEO_CODE.astype(str).str.contains('\.').any() == False:
-        # If no point is found in the entire dataset, they have to be intoduced
-        # in front of the last 2 numbers of the ID.
-        data.ALT_GEO_CODE = data.ALT_GEO_CODE/100
-    data.ALT_GEO_CODE = data.ALT_GEO_CODE.apply(lambda a: '%010.2f' % a)
-    # Select columns containing geographical information
-    data_part1 = data.loc[:,data.columns.str.contains('GEO')]
-    # Select columns containing the variables and measurements
-    data_part2 = data.loc[:, [col_var, col_val]]
-    # Merge columns to one data frame
-    data_selected = pd.concat([data_part1,data_part2], axis=1)
-    # Only keep census tract data
-    data_output = data_selected.loc[data_selected['GEO_LEVEL']==geo_level_tract]
+    data_output.ALT_GEO_CODE = format_tract_id(data_output.ALT_GEO_CODE,
+                                               has_point, compact)
+    # Put the geographical columns in front of the variables and measurements
+    geo_cols = list(data_output.columns[data_output.columns
+                                        .str.contains('GEO')])
+    data_output = data_output.loc[:, geo_cols + [col_var, col_val]]
     # Rename the columns
     data_output = data_output.rename({col_var: 'variable',
                                       col_val: 'value',
                                       'ALT_GEO_CODE': 'tract'},
                                      axis = 1)
-    # Strip spaces from variable names
-    data_output['variable'] = data_output['variable'].str.strip()
-    data_output['value'] = pd.to_numeric(data_output['value'], errors = 'coerce')
     # Set column names to lower
     data_output.columns = data_output.columns.str.lower()
+    if compact:
+        data_output = cc.compact_dtypes(data_output)
     return data_output
 
+def _contains_point(codes):
+    """
+    Check if any of the codes contains a point when converted to a string.
+    """
+    return pd.Series(codes).astype(str).str.contains('\\.').any()
+
+@instrument
+def format_tract_id(codes, has_point = None, categorical = False):
+    """
+    Set census tract identifiers to a string with a fixed format.
+
+    The identifiers are formatted as a string of length 10 with 2 decimals
+    (e.g. '0005001.02'). The formatting is done once for every unique
+    identifier, after which the result is mapped back to all rows.
+
+    Parameters
+    ----------
+    codes : Series
+        Numeric census tract identifiers.
+    has_point : boolean, optional
+        Do the identifiers already contain the point in front of the last 2
+        numbers. If not, the point is introduced by dividing by 100. The
+        default is None, in which case this is checked on the codes.
+    categorical : boolean, optional
+        Return the identifiers as a categorical, which stores every unique
+        identifier once. The default is False.
+
+    Returns
+    -------
+    tract_id : Series
+        The formatted census tract identifiers.
+
+    """
+    code_index, code_values = pd.factorize(codes)
+    if has_point is None:
+        has_point = _contains_point(code_values)
+    if has_point == False:
+        # If no point is found in the entire dataset, they have to be intoduced
+        # in front of the last 2 numbers of the ID.
+        code_values = code_values/100
+    # The last element is used for missing values (code -1)
+    formatted = np.array(['%010.2f' % a for a in code_values] +
+                         ['%010.2f' % np.nan], dtype = object)
+    if categorical:
+        # Codes can be formatted to the same identifier
+        format_index, format_values = pd.factorize(formatted)
+        tract_id = pd.Categorical.from_codes(format_index[code_index],
+                                             format_values
+                                             ).remove_unused_categories()
+    else:
+        tract_id = formatted[code_index]
+    tract_id = pd.Series(tract_id, index = codes.index, name = codes.name)
+    return tract_id
+
+@instrument
 def reshape_census_CA(data, var_oi):
     """
     Select variables of interest and reschape data.
@@ -76,7 +232,9 @@ def reshape_census_CA(data, var_oi):
     Parameters
     ----------
     data : DataFrame
-        Data frame with census data of Canada.
+        Data frame with census data of Canada. This can also be a dask data
+        frame, which is filtered on the variables of interest per partition
+        before it is collected.
     var_oi : list
         Variables of interest.
 
@@ -86,21 +244,13 @@ def reshape_census_CA(data, var_oi):
         Data frame with the census data in a wide format.
 
     """
-    # Select variables of interest
-    data_filtered = data.loc[data['variable'].isin(var_oi)]
-    # Check for duplicates
-    duplicates = (data_filtered
-                  .loc[:,['tract', 'variable']]
-                  .duplicated(keep = 'first'))
-    # Remove duplicates
-    data_no_duplicates = (data_filtered
-                          .loc[:,['tract', 'variable', 'value']]
-                          .loc[duplicates == False]
-                          )
-    # Pivot data frame wider
-    data_wide = data_no_duplicates.pivot(index = 'tract',
-                columns='variable',
-                values= 'value').reset_index()
+    if hasattr(data, 'compute'):
+        # Dask data frame: only the variables of interest are collected
+        data = data.loc[data['variable'].isin(var_oi),
+                        ['tract', 'variable', 'value']].compute()
+    # Select variables of interest and pivot data frame wider in one pass
+    data_wide = cc.long_to_wide(data, index = 'tract', columns = 'variable',
+                                values = 'value', keep_columns = var_oi)
     return data_wide
 
 # %%
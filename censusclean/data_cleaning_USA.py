@@ -3,13 +3,25 @@ Functions to simplify the cleaning of American census data.
 """
 #%% Preamble
 # load packages
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import pandas as pd
 import numpy as np
 import geopandas as gpd
 import censusclean.censusclean as cc
+from censusclean.cache import cached_clean
+from censusclean.profiling import instrument, section
 #%% Load data
+# Geographic area name of a census tract, e.g. 'Census Tract 12.01, Fulton
+# County, Georgia'. Newer files use semicolons instead of commas.
+TRACT_NAME = re.compile(r'^Census Tract (?P<tract>[^,;]+)[,;]\s*'
+                        r'(?P<county>[^,;]+?)(?: County)?[,;]\s*'
+                        r'(?P<state>[^,;]+)$')
 # Load census data
-def clean_census_us(filename, prefix = "Estimate!!"):
+@instrument
+def clean_census_us(filename, prefix = "Estimate!!", backend = 'pandas'):
     """
     Clean census data from the United States of America.
     
@@ -24,6 +36,12 @@ def clean_census_us(filename, prefix = "Estimate!!"):
         Prefix that charachterises the columns needed, but has no further use 
         after a subset of only these columns is made. The columns with geo-
         graphical information will be preserved as well.
+    backend : string, optional
+        'pandas' or 'dask'. With 'dask', filename can also be a list of files
+        or a pattern (e.g. the same table for every state). Every file is a
+        partition which is read and filtered on the census tracts in
+        parallel (see cc.read_csv_partitioned), after which the tracts are
+        collected in a pandas data frame. The default is 'pandas'.
 
     Returns
     -------
@@ -31,34 +49,102 @@ def clean_census_us(filename, prefix = "Estimate!!"):
         The cleaned data frame.
 
     """
-    data = pd.read_csv(filename,
-                       header=1, na_values=('-','(X)'), decimal='.',
-                       low_memory=False)
-    # Clean the dataframe
-    # Filter on tract data only
-    data = data.loc[data['Geographic Area Name'].str.contains('Tract'),:]
-    # Select the columns with usefull data based on the prefix (Optional)
+    cc._check_backend(backend)
     id_cols = ['Geography',
                'Geographic Area Name']
+    # Only parse the columns with the prefix, the other columns (e.g. the
+    # margins of error) are skipped while reading
+    read_options = dict(header=1, na_values=('-','(X)'), decimal='.',
+                        usecols = cc.prefix_columns(prefix, id_cols),
+                        low_memory=False)
+    if backend == 'dask':
+        # Integer columns of one state can contain missing values in another
+        data = cc.read_csv_partitioned(filename, assume_missing = True,
+                                       **read_options)
+        data = data.loc[data['Geographic Area Name'].str.contains('Tract'),
+                        :].compute().reset_index(drop = True)
+    else:
+        with section('read_csv'):
+            data = pd.read_csv(filename, **read_options)
+        # Clean the dataframe
+        # Filter on tract data only
+        data = data.loc[data['Geographic Area Name'].str.contains('Tract'),:]
+    # Select the columns with usefull data based on the prefix (Optional)
     data_estimates = cc.select_by_prefix(data, prefix, id_cols)
-    # Extract census tract identifiers
-    col_id = 'Geographic Area Name'
-    new_id = 'Census Tract'
-    separators = [', ', ' ']
-    locations = [0, 2]
-    data_estimates = cc.extract_part(data_estimates, 
-                                     col_id, new_id, 
-                                     separators, locations)
-    col_id = 'Geographic Area Name'
-    new_id = 'County'
-    separators = [', ', ' ']
-    locations = [1, 0]
-    data_estimates = cc.extract_part(data_estimates, 
-                                     col_id, new_id, 
-                                     separators, locations)
+    # Extract census tract and county identifiers
+    data_estimates = cc.extract_groups(data_estimates,
+                                       'Geographic Area Name', TRACT_NAME,
+                                       {'tract': 'Census Tract',
+                                        'county': 'County'})
     # Clean column names
     data_estimates = cc.set_format_colnames(data = data_estimates, sep='!!')
     return data_estimates
 
+def _clean_census_us_cached(filename, prefix, cache_dir):
+    """
+    Clean census data from the United States, using the cache if given.
+    """
+    if cache_dir is None:
+        return clean_census_us(filename, prefix)
+    return cached_clean(clean_census_us, filename, cache_dir = cache_dir,
+                        prefix = prefix)
 
+@instrument
+def clean_census_us_batch(filenames, prefixes = "Estimate!!",
+                          max_workers = None, cache_dir = None):
+    """
+    Clean multiple census files from the United States of America at once.
+
+    Identical combinations of file and prefix are only cleaned once. The
+    files are cleaned concurrently in a pool of processes. Where processes
+    are started with spawn (Windows and macOS), they import the calling
+    script again, so the call has to be placed under an
+    if __name__ == '__main__': guard, or max_workers has to be 1.
 
+    Parameters
+    ----------
+    filenames : list
+        Names and paths of the census files.
+    prefixes : list or string, optional
+        Prefix of the columns needed for every file, see clean_census_us. A
+        single string is used for all files. The default is "Estimate!!".
+    max_workers : int, optional
+        Maximum number of processes. If 1, the files are cleaned one after
+        the other in the current process. The default is None, which uses
+        the number of processors.
+    cache_dir : string, optional
+        Folder of the cache of cleaned files, see cache.cached_clean. The
+        default is None, which does not use a cache.
+
+    Returns
+    -------
+    data_list : list
+        The cleaned data frames, in the same order as filenames.
+
+    """
+    if len(filenames) == 0:
+        return []
+    if isinstance(prefixes, str):
+        prefixes = [prefixes]*len(filenames)
+    if len(prefixes) != len(filenames):
+        raise ValueError('filenames and prefixes have to be equally long.')
+    sources = [(os.path.abspath(filename), prefix)
+               for filename, prefix in zip(filenames, prefixes)]
+    unique_sources = list(dict.fromkeys(sources))
+    clean_function = partial(_clean_census_us_cached, cache_dir = cache_dir)
+    unique_files, unique_prefixes = zip(*unique_sources)
+    if max_workers == 1 or len(unique_sources) == 1:
+        cleaned = list(map(clean_function, unique_files, unique_prefixes))
+    else:
+        with ProcessPoolExecutor(max_workers = max_workers) as executor:
+            cleaned = list(executor.map(clean_function,
+                                        unique_files, unique_prefixes))
+    cleaned = dict(zip(unique_sources, cleaned))
+    # Every repeated file gets its own copy, so they can be changed separately
+    data_list = []
+    for i, source in enumerate(sources):
+        if source in sources[:i]:
+            data_list.append(cleaned[source].copy())
+        else:
+            data_list.append(cleaned[source])
+    return data_list
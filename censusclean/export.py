@@ -0,0 +1,122 @@
+"""
+Functions to export the prepared census tracts.
+
+Besides Shapefile, the layers can be written as GeoParquet and FlatGeobuf.
+These formats keep the full column names and can be read partially: GeoParquet
+stores the bounding box of every feature and statistics per row group, and
+FlatGeobuf has a spatial index.
+"""
+#%% Preamble
+import os
+from censusclean.profiling import instrument
+#%% Functions
+def write_geoparquet(layer, filename, row_group_size = 10000,
+                     spatial_sort = True):
+    """
+    Write a GeoDataFrame to a GeoParquet file.
+
+    Parameters
+    ----------
+    layer : GeoDataFrame
+        The layer to be written.
+    filename : string
+        Name and path of the file.
+    row_group_size : int, optional
+        Maximum number of features per row group. The default is 10000.
+    spatial_sort : boolean, optional
+        Sort the features along a Hilbert curve first, so the features of a
+        row group are close together and the bounding box statistics of the
+        row groups allow to skip most of them when reading a region. The
+        default is True.
+
+    Returns
+    -------
+    None.
+
+    """
+    if spatial_sort and len(layer) > 0:
+        order = layer.geometry.hilbert_distance().to_numpy().argsort(
+            kind = 'stable')
+        layer = layer.iloc[order]
+    layer.to_parquet(filename, write_covering_bbox = True,
+                     row_group_size = row_group_size)
+
+def write_flatgeobuf(layer, filename, spatial_index = True):
+    """
+    Write a GeoDataFrame to a FlatGeobuf file.
+
+    Parameters
+    ----------
+    layer : GeoDataFrame
+        The layer to be written.
+    filename : string
+        Name and path of the file.
+    spatial_index : boolean, optional
+        Add a spatial index to the file. The default is True.
+
+    Returns
+    -------
+    None.
+
+    """
+    layer.to_file(filename, driver = 'FlatGeobuf',
+                  SPATIAL_INDEX = 'YES' if spatial_index else 'NO')
+
+def write_shapefile(layer, filename):
+    """
+    Write a GeoDataFrame to a Shapefile.
+
+    Column names longer than 10 characters are truncated by the format.
+
+    Parameters
+    ----------
+    layer : GeoDataFrame
+        The layer to be written.
+    filename : string
+        Name and path of the file.
+
+    Returns
+    -------
+    None.
+
+    """
+    layer.to_file(filename)
+
+# Function used for every file extension
+WRITERS = {'.parquet': write_geoparquet,
+           '.fgb': write_flatgeobuf,
+           '.shp': write_shapefile}
+
+@instrument
+def export_layer(layer, filename, formats = None):
+    """
+    Write a GeoDataFrame to one or multiple formats.
+
+    Parameters
+    ----------
+    layer : GeoDataFrame
+        The layer to be written.
+    filename : string
+        Name and path of the file. The extension is replaced by the
+        extension of every format.
+    formats : list, optional
+        Extensions of the formats: '.parquet' (GeoParquet), '.fgb'
+        (FlatGeobuf) and/or '.shp' (Shapefile). The default is None, in
+        which case the format is given by the extension of filename.
+
+    Returns
+    -------
+    filenames : list
+        Names of the written files.
+
+    """
+    stem, extension = os.path.splitext(filename)
+    if formats is None:
+        formats = [extension]
+    filenames = []
+    for file_format in formats:
+        if file_format not in WRITERS:
+            raise ValueError('Unknown format: %s' % file_format)
+        WRITERS[file_format](layer, stem + file_format)
+        filenames.append(stem + file_format)
+    return filenames
@@ -0,0 +1,155 @@
+"""
+Functions to compute metrics of geometries (e.g. the area of census tracts).
+
+The metrics are computed from the coordinate arrays of all geometries at
+once, instead of reprojecting a whole GeoDataFrame: the coordinates are
+extracted with shapely, transformed in a single call and the areas of the
+rings are summed with np.bincount. The transformers between two CRS are
+cached, so repeated reprojections between the same CRS reuse them.
+"""
+#%% Preamble
+from functools import lru_cache
+import numpy as np
+import shapely
+import pyproj
+from censusclean.profiling import instrument
+#%% Functions
+@lru_cache(maxsize = 32)
+def _cached_transformer(crs_from, crs_to):
+    """
+    Create the transformer between two CRS, given as pyproj CRS.
+    """
+    return pyproj.Transformer.from_crs(crs_from, crs_to, always_xy = True)
+
+def transformer(crs_from, crs_to):
+    """
+    Get the transformer between two CRS.
+
+    The transformers are cached, so creating the transformer of the same CRS
+    again costs nothing.
+
+    Parameters
+    ----------
+    crs_from : string or CRS
+        Source CRS, e.g. 'EPSG:4269'.
+    crs_to : string or CRS
+        Target CRS, e.g. 'EPSG:2163'.
+
+    Returns
+    -------
+    transformer : Transformer
+        Transformer with the coordinates in x, y (longitude, latitude) order.
+
+    """
+    if crs_from is None or crs_to is None:
+        raise ValueError('Both CRS must be set to transform coordinates.')
+    return _cached_transformer(pyproj.CRS.from_user_input(crs_from),
+                               pyproj.CRS.from_user_input(crs_to))
+
+def _geometry_array(geometries):
+    """
+    Get the geometries of a GeoDataFrame, GeoSeries or array as an ndarray,
+    without copying them.
+    """
+    if hasattr(geometries, 'geometry'):
+        geometries = geometries.geometry.values
+    return np.asarray(geometries)
+
+@instrument
+def reproject(geometries, crs_from, crs_to):
+    """
+    Reproject geometries, without copying the other columns of their layer.
+
+    Parameters
+    ----------
+    geometries : GeoDataFrame, GeoSeries or ndarray
+        The geometries.
+    crs_from : string or CRS
+        CRS of the geometries.
+    crs_to : string or CRS
+        Target CRS.
+
+    Returns
+    -------
+    geometries : ndarray
+        The reprojected geometries.
+
+    """
+    geometries = _geometry_array(geometries)
+    transform = transformer(crs_from, crs_to)
+    def transform_coordinates(coordinates):
+        return np.column_stack(transform.transform(coordinates[:,0],
+                                                   coordinates[:,1]))
+    return shapely.transform(geometries, transform_coordinates)
+
+def _polygon_rings(geometries):
+    """
+    Get the rings of all polygons, with the geometry to which every ring
+    belongs and whether it is an exterior ring.
+    """
+    parts, geometry_index = shapely.get_parts(geometries, return_index = True)
+    rings, part_index = shapely.get_rings(parts, return_index = True)
+    # The first ring of every polygon is its exterior
+    exterior = np.ones(len(rings), dtype = bool)
+    exterior[1:] = part_index[1:] != part_index[:-1]
+    return rings, geometry_index[part_index], exterior
+
+@instrument
+def area(geometries, crs = None, method = 'equal_area',
+         equal_area_crs = 'EPSG:6933'):
+    """
+    Compute the areas of polygons in square meters.
+
+    Parameters
+    ----------
+    geometries : GeoDataFrame, GeoSeries or ndarray
+        Polygons or multipolygons.
+    crs : string or CRS, optional
+        CRS of the geometries. The default is None, which uses the CRS of
+        geometries.
+    method : string, optional
+        Either 'equal_area', which computes the areas in equal_area_crs, or
+        'geodesic', which computes the areas on the ellipsoid of crs. The
+        default is 'equal_area'.
+    equal_area_crs : string or CRS, optional
+        Equal-area projection used by method 'equal_area'. The default is
+        'EPSG:6933' (the global cylindrical equal-area projection); for the
+        United States this can be 'EPSG:2163'.
+
+    Returns
+    -------
+    areas : ndarray
+        Area of every geometry, 0 for empty geometries.
+
+    """
+    if crs is None:
+        crs = getattr(geometries, 'crs', None)
+    geometries = _geometry_array(geometries)
+    rings, ring_geometry, exterior = _polygon_rings(geometries)
+    coordinates, ring_index = shapely.get_coordinates(rings,
+                                                      return_index = True)
+    if method == 'equal_area':
+        x, y = transformer(crs, equal_area_crs).transform(coordinates[:,0],
+                                                          coordinates[:,1])
+        # Shoelace formula on the pairs of successive points of every ring
+        same_ring = ring_index[1:] == ring_index[:-1]
+        cross = (x[:-1]*y[1:] - x[1:]*y[:-1])[same_ring]
+        ring_area = np.abs(np.bincount(ring_index[1:][same_ring], cross,
+                                       minlength = len(rings)))/2
+    elif method == 'geodesic':
+        if crs is None:
+            raise ValueError('The CRS must be set to compute geodesic areas.')
+        crs = pyproj.CRS.from_user_input(crs)
+        lon, lat = transformer(crs, crs.geodetic_crs).transform(
+            coordinates[:,0], coordinates[:,1])
+        geod = crs.get_geod()
+        # The geodesic area is computed per ring by PROJ
+        ring_start = np.searchsorted(ring_index, np.arange(len(rings) + 1))
+        ring_area = np.array([abs(geod.polygon_area_perimeter(
+            lon[start:end], lat[start:end])[0])
+            for start, end in zip(ring_start[:-1], ring_start[1:])])
+    else:
+        raise ValueError("method has to be 'equal_area' or 'geodesic'.")
+    # The areas of the holes are subtracted
+    ring_area = np.where(exterior, ring_area, -ring_area)
+    return np.bincount(ring_geometry, ring_area, minlength = len(geometries))
@@ -0,0 +1,193 @@
+"""
+Functions to derive indicators from census data.
+
+The indicators (e.g. the share of the population under 10 years) are declared
+as a sum of columns, optionally divided by another column and multiplied by a
+scale. The declarations of Canada and the United States produce the same
+indicator names, so the output of both countries has the same format.
+"""
+#%% Preamble
+import numpy as np
+from censusclean.profiling import instrument
+#%% Declarations
+# An indicator is a dictionary with the following keys:
+#   'sum': list of columns (or other indicators) which are summed.
+#   'contains': substring of the names of columns which are summed, so the
+#               columns of other census vintages are found as well (optional).
+#   'per': column (or other indicator) by which the sum is divided (optional).
+#   'scale': number by which the result is multiplied (optional).
+#   'skipna': if False, the sum is missing when any of its values is missing,
+#             as with a + b. The default is True, as with DataFrame.sum.
+# An indicator in 'sum' or 'per' refers to the sum of that indicator, before
+# the division and scaling.
+POPULATION_CA = 'Population, 2021'
+EDUCATION_CA = ('Total - Highest certificate, diploma or degree for the '
+                'population aged 15 years and over in private households - '
+                '25% sample data')
+DWELLINGS_CA = ('Total - Occupied private dwellings by structural type of '
+                'dwelling - 100% data')
+CA_INDICATORS = {
+    'under_10_y': {'sum': ['0 to 4 years', '5 to 9 years'],
+                   'per': POPULATION_CA, 'scale': 100},
+    'under_15_y': {'sum': ['under_10_y', '10 to 14 years'],
+                   'per': POPULATION_CA, 'scale': 100},
+    'over_80_y': {'sum': ['80 to 84 years', '85 to 89 years',
+                          '90 to 94 years', '95 to 99 years',
+                          '100 years and over'],
+                  'per': POPULATION_CA, 'scale': 100},
+    'over_70_y': {'sum': ['over_80_y', '70 to 74 years', '75 to 79 years'],
+                  'per': POPULATION_CA, 'scale': 100},
+    'over_65_y': {'sum': ['over_70_y', '65 to 69 years'],
+                  'per': POPULATION_CA, 'scale': 100},
+    'alone': {'sum': ['1 person'], 'per': POPULATION_CA, 'scale': 100,
+              'skipna': False},
+    'no_dipl': {'sum': ['No certificate, diploma or degree'],
+                'per': EDUCATION_CA, 'scale': 100, 'skipna': False},
+    'high_sch': {'sum': ['Secondary (high) school diploma or equivalency '
+                         'certificate'],
+                 'per': EDUCATION_CA, 'scale': 100, 'skipna': False},
+    'degree': {'sum': ['Postsecondary certificate, diploma or degree'],
+               'per': EDUCATION_CA, 'scale': 100, 'skipna': False},
+    'apartments': {'contains': 'partment', 'per': DWELLINGS_CA,
+                   'scale': 100},
+    'attached': {'sum': ['Row house'], 'per': DWELLINGS_CA, 'scale': 100,
+                 'skipna': False},
+    'detached': {'sum': ['Semi-detached house', 'Single-detached house'],
+                 'per': DWELLINGS_CA, 'scale': 100, 'skipna': False}
+    }
+US_INDICATORS = {
+    'under_10_y': {'sum': ['total population age under 5 years',
+                           'total population age 5 to 9 years']},
+    'under_15_y': {'sum': ['under_10_y',
+                           'total population age 10 to 14 years']},
+    'over_80_y': {'sum': ['total population age 80 to 84 years',
+                          'total population age 85 years and over']},
+    'over_70_y': {'sum': ['over_80_y',
+                          'total population age 70 to 74 years',
+                          'total population age 75 to 79 years']},
+    'over_65_y': {'sum': ['over_70_y',
+                          'total population age 65 to 69 years']},
+    'pre_1960': {'sum': ['year structure built 1939 or earlier',
+                         'year structure built 1940 to 1959']},
+    'pre_1980': {'sum': ['pre_1960', 'year structure built 1960 to 1979']}
+    }
+#%% Functions
+def compile_indicators(indicators, columns = None):
+    """
+    Compile the declarations of indicators to a matrix.
+
+    The columns summed directly by every indicator become a column of a
+    matrix of zeros and ones with a row for every source column. Indicators
+    used in the sum of another indicator are returned separately, so their
+    sums are added to the other sum instead of summing their columns again.
+
+    Parameters
+    ----------
+    indicators : dict
+        Declarations of the indicators, see CA_INDICATORS for an example.
+    columns : list, optional
+        Columns of the data, in which the substrings of 'contains' are
+        looked up. The default is None, in which case 'contains' is ignored.
+
+    Returns
+    -------
+    source_cols : list
+        Names of the columns used in the sums.
+    sum_matrix : ndarray
+        Matrix with a row for every source column and a column for every
+        indicator.
+    nested : list
+        Pairs (indicator, indicator in its sum) of positions of indicators,
+        ordered so every sum is complete before it is added to another sum.
+
+    """
+    names = list(indicators)
+    direct = {}
+    for name in names:
+        cols = [col for col in indicators[name].get('sum', [])
+                if col not in indicators]
+        if 'contains' in indicators[name] and columns is not None:
+            cols += [col for col in columns if col not in indicators and
+                     indicators[name]['contains'] in str(col)]
+        direct[name] = list(dict.fromkeys(cols))
+    # Order the indicators so every indicator comes after those in its sum
+    ordered = []
+    def visit(name, path):
+        if name in path:
+            raise ValueError('The indicator %s refers to itself.' % name)
+        if name in ordered:
+            return
+        for col in indicators[name].get('sum', []):
+            if col in indicators:
+                visit(col, path + [name])
+        ordered.append(name)
+    for name in names:
+        visit(name, [])
+    nested = [(names.index(name), names.index(col)) for name in ordered
+              for col in indicators[name].get('sum', [])
+              if col in indicators]
+    source_cols = list(dict.fromkeys(col for name in names
+                                     for col in direct[name]))
+    sum_matrix = np.zeros((len(source_cols), len(names)))
+    for j, name in enumerate(names):
+        for col in direct[name]:
+            sum_matrix[source_cols.index(col), j] = 1
+    return source_cols, sum_matrix, nested
+
+@instrument
+def derive_indicators(data, indicators, min_count = 0):
+    """
+    Add indicators to a data frame.
+
+    The sums of the columns are computed in a single matrix product over the
+    source columns, after which the sums of nested indicators are added.
+    Missing values are left out of the sums, as in DataFrame.sum, unless
+    the indicator is declared with 'skipna': False.
+
+    Parameters
+    ----------
+    data : DataFrame
+        Data frame with census data in a wide format.
+    indicators : dict
+        Declarations of the indicators, e.g. CA_INDICATORS or US_INDICATORS.
+    min_count : int, optional
+        Number of available values needed for a sum of an indicator with
+        skipna, as in DataFrame.sum. The default is 0, so a sum of only
+        missing values is 0; with 1 it is missing.
+
+    Returns
+    -------
+    data : DataFrame
+        Input data frame with an extra column for every indicator.
+
+    """
+    source_cols, sum_matrix, nested = compile_indicators(indicators,
+                                                         data.columns)
+    missing_cols = [col for col in source_cols if col not in data.columns]
+    if len(missing_cols) > 0:
+        raise KeyError('Columns not found: %s' % missing_cols)
+    values = data.loc[:,source_cols].to_numpy(dtype = float)
+    available = np.isnan(values) == False
+    sums = np.where(available, values, 0) @ sum_matrix
+    counts = available @ sum_matrix
+    n_values = sum_matrix.sum(axis = 0)
+    # Build on the sums of the nested indicators
+    for j, k in nested:
+        sums[:,j] += sums[:,k]
+        counts[:,j] += counts[:,k]
+        n_values[j] += n_values[k]
+    names = list(indicators)
+    # Indicators without skipna need all their values
+    required = np.array([min_count if indicators[name].get('skipna', True)
+                         else n_values[j] for j, name in enumerate(names)])
+    sums[counts < required] = np.nan
+    for j, name in enumerate(names):
+        result = sums[:,j]
+        denominator = indicators[name].get('per')
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            if denominator in indicators:
+                result = result/sums[:,names.index(denominator)]
+            elif denominator is not None:
+                result = result/data[denominator].to_numpy(dtype = float)
+        data[name] = result*indicators[name].get('scale', 1)
+    return data
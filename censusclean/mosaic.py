@@ -0,0 +1,144 @@
+"""
+Functions to build a quality mosaic of satellite images of multiple dates.
+
+This is the local equivalent of the Earth Engine steps in the 'Download'
+scripts, where the NDVI is added to every Sentinel-2 image
+(addQualityBands) and the images are combined with qualityMosaic('nd'):
+every pixel of the mosaic is taken from the image with the highest NDVI at
+that pixel. Here the images are already downloaded and aligned on the same
+grid, so images of multiple dates can be combined in one run.
+
+The mosaic is built tile by tile in a pool of threads. Every tile is written
+to a memory-mapped array, so the mosaic does not have to fit in memory,
+after which the array is written to a GeoTIFF.
+"""
+#%% Preamble
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import rasterio
+from rasterio import windows
+from censusclean.profiling import instrument
+from censusclean.zonal import ndvi
+from censusclean.raster import _block_windows
+#%% Functions
+def _band_number(src, band):
+    """
+    Get the number of a band given by its number or its description.
+    """
+    if isinstance(band, int):
+        return band
+    if band not in src.descriptions:
+        raise ValueError('Band %s not found in %s, the bands are %s.' %
+                         (band, src.name, src.descriptions))
+    return src.descriptions.index(band) + 1
+
+def _check_grids(sources):
+    """
+    Check if the images have the same grid, bands and data type.
+    """
+    first = sources[0]
+    for src in sources[1:]:
+        if (src.shape != first.shape or src.transform != first.transform or
+                src.crs != first.crs or src.count != first.count or
+                src.dtypes[0] != first.dtypes[0]):
+            raise ValueError('The images %s and %s are not aligned, reproject '
+                             'them to the same grid first.' %
+                             (first.name, src.name))
+
+def _mosaic_tile(filenames, window, band_numbers, mosaic):
+    """
+    Select for every pixel of a tile the image with the highest NDVI and
+    write the tile to the mosaic.
+    """
+    # Every thread opens its own datasets, which are not thread-safe
+    scenes = []
+    quality = []
+    for filename in filenames:
+        with rasterio.open(filename) as src:
+            data = src.read(window = window, masked = True)
+        nd = ndvi(data[band_numbers[0] - 1].data,
+                  data[band_numbers[1] - 1].data)
+        # Pixels without data are never selected
+        nd[np.ma.getmaskarray(data).any(axis = 0) | np.isnan(nd)] = -np.inf
+        scenes.append(data.data)
+        quality.append(nd)
+    quality = np.stack(quality)
+    best = quality.argmax(axis = 0)
+    valid = np.isfinite(quality.max(axis = 0))
+    scenes = np.stack(scenes)
+    tile = np.take_along_axis(scenes, best[None,None], axis = 0)[0]
+    rows, cols = windows.window_index(window)
+    mosaic[:-1, rows, cols] = tile
+    mosaic[-1, rows, cols] = np.where(valid, best + 1, 0)
+    return window
+
+@instrument
+def quality_mosaic(filenames, dst_filename, bands = (4, 3),
+                   block_size = 512, max_workers = None, **profile):
+    """
+    Combine aligned images into a mosaic of the pixels with the highest NDVI.
+
+    Parameters
+    ----------
+    filenames : list
+        Names and paths of the images, all on the same grid and with the
+        same bands.
+    dst_filename : string
+        Name and path of the output GeoTIFF. It contains the bands of the
+        images, followed by a band 'scene' with the number of the image of
+        every pixel (1 for the first image, 0 where no image has data).
+    bands : tuple, optional
+        The near infrared and red bands used for the NDVI, given by their
+        number or description. The default is (4, 3), the bands 'B4_NIR'
+        and 'B3_red' of the exported Sentinel-2 images.
+    block_size : int, optional
+        Width and height in pixels of the tiles. The default is 512.
+    max_workers : int, optional
+        Number of threads. The default is None, which uses the default of
+        ThreadPoolExecutor.
+    **profile :
+        Options of the output file, e.g. compress = 'deflate'.
+
+    Returns
+    -------
+    dst_filename : string
+        Name and path of the output GeoTIFF.
+
+    """
+    sources = [rasterio.open(filename) for filename in filenames]
+    try:
+        _check_grids(sources)
+        band_numbers = [_band_number(sources[0], band) for band in bands]
+        dst_profile = sources[0].profile.copy()
+        descriptions = sources[0].descriptions
+    finally:
+        for src in sources:
+            src.close()
+    if (np.issubdtype(dst_profile['dtype'], np.integer) and
+            len(filenames) > np.iinfo(dst_profile['dtype']).max):
+        raise ValueError('Too many images for the data type of the scene '
+                         'band.')
+    count, height, width = (dst_profile['count'], dst_profile['height'],
+                            dst_profile['width'])
+    dst_profile.update(driver = 'GTiff', count = count + 1, tiled = True,
+                       blockxsize = 256, blockysize = 256)
+    dst_profile.update(profile)
+    tiles = _block_windows(width, height, block_size)
+    folder = os.path.dirname(os.path.abspath(dst_filename))
+    with tempfile.TemporaryDirectory(dir = folder) as temp_folder:
+        mosaic = np.lib.format.open_memmap(
+            os.path.join(temp_folder, 'mosaic.npy'), mode = 'w+',
+            dtype = dst_profile['dtype'], shape = (count + 1, height, width))
+        # The tiles are written to separate parts of the array
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            list(executor.map(lambda tile: _mosaic_tile(
+                filenames, tile, band_numbers, mosaic), tiles))
+        with rasterio.open(dst_filename, 'w', **dst_profile) as dst:
+            for tile in tiles:
+                rows, cols = windows.window_index(tile)
+                dst.write(mosaic[:, rows, cols], window = tile)
+            dst.descriptions = tuple(descriptions) + ('scene',)
+        del mosaic
+    return dst_filename
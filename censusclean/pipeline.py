@@ -0,0 +1,444 @@
+"""
+Pipeline to prepare the census data of a city from a configuration file.
+
+The preparation is described as a list of stages in a JSON file, e.g.
+
+    {"root": "../../..",
+     "workdir": "Data preparation/Raw data/Canada/pipeline",
+     "stages": [
+         {"name": "census", "kind": "clean_ca",
+          "inputs": {"filename": "Data preparation/Raw data/census.csv"},
+          "params": {"col_var": "CHARACTERISTIC_NAME",
+                     "col_val": "C1_COUNT_TOTAL"}},
+         {"name": "census_wide", "kind": "reshape_ca",
+          "inputs": {"data": "census"},
+          "params": {"var_oi": ["Population, 2021"]}}]}
+
+An input is either the name of another stage or the path of a file. The
+output of every stage is stored in the working folder, together with a key
+of its kind, parameters and inputs. When the pipeline is run again, only the
+stages whose key has changed are executed. Stages that do not depend on each
+other are executed in parallel.
+
+Multiple cities are prepared in one run: the national or state-wide census
+files and tract layers are read and cleaned once, the tracts are assigned to
+the cities with an 'assign_city' stage, the census tables are partitioned by
+city with 'partition_by_city' stages, and the export with the parameter
+"by": "city" and a filename containing {} writes the files of every city
+(see 'Census data/Canada/pipeline_cities_CA.json').
+
+The pipeline can be run from the command line:
+
+    python -m censusclean path/to/config.json
+"""
+#%% Preamble
+import os
+import sys
+import json
+import hashlib
+import argparse
+import importlib
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import pandas as pd
+import geopandas as gpd
+import pyarrow.parquet as pq
+import censusclean.censusclean as cc
+from censusclean.cache import file_fingerprint
+from censusclean.data_cleaning_CA import clean_census_ca, reshape_census_CA
+from censusclean.data_cleaning_USA import clean_census_us
+from censusclean.indicators import derive_indicators
+from censusclean.export import export_layer
+#%% Stages
+def _import_object(path):
+    """
+    Import an object from a path of the form 'module:name'.
+    """
+    module_name, object_name = path.split(':')
+    return getattr(importlib.import_module(module_name), object_name)
+
+def _merge(left, right, **kwargs):
+    """
+    Merge two data frames.
+    """
+    return left.merge(right, **kwargs)
+
+def _derive(data, indicators, min_count = 0):
+    """
+    Derive indicators given by the path of their declarations.
+    """
+    return derive_indicators(data, _import_object(indicators), min_count)
+
+def _select(data, columns):
+    """
+    Select columns, which are renamed when a dictionary is given.
+    """
+    data = data.loc[:,list(columns)]
+    if isinstance(columns, dict):
+        data = data.rename(columns = columns)
+    return data
+
+def _export(data, filename, by = None, formats = None):
+    """
+    Write a GeoDataFrame to one or multiple formats, see export_layer.
+
+    If by is given, the files are written for every value of this column,
+    e.g. for every city. The value replaces {} in filename. Returns the
+    names of the written files.
+    """
+    if by is None:
+        return export_layer(data, filename, formats)
+    filenames = []
+    for value, data_part in data.groupby(by):
+        filenames += export_layer(data_part, filename.format(value), formats)
+    return filenames
+
+def _function(function, **kwargs):
+    """
+    Call a function given by its path, e.g. 'mymodule:prepare_houses'.
+    """
+    return _import_object(function)(**kwargs)
+
+# Functions executed by every kind of stage. The inputs and the parameters of
+# the stage are passed as keyword arguments.
+STAGE_KINDS = {
+    'clean_ca': clean_census_ca,
+    'clean_us': clean_census_us,
+    'reshape_ca': reshape_census_CA,
+    'read_geometry': gpd.read_file,
+    'join_by_location': cc.join_by_location,
+    'assign_city': cc.assign_city,
+    'partition_by_city': cc.partition_by_city,
+    'merge': _merge,
+    'derive': _derive,
+    'select': _select,
+    'export': _export,
+    'function': _function
+    }
+# Inputs which are paths of files written by the stage instead of read
+OUTPUT_PARAMS = {'export': ['filename']}
+# Files read together with a shapefile, which are part of its fingerprint
+SHAPEFILE_SIDECARS = ['.shp', '.dbf', '.shx', '.prj', '.cpg']
+#%% Functions
+def read_config(filename):
+    """
+    Read the configuration of a pipeline.
+
+    Relative paths in the configuration are relative to the folder given by
+    'root', which is itself relative to the folder of the configuration
+    file.
+
+    Parameters
+    ----------
+    filename : string
+        Name and path of the JSON configuration file.
+
+    Returns
+    -------
+    config : dict
+        Configuration with a 'stages' list, a 'workdir' and a 'root' folder.
+
+    """
+    with open(filename, encoding = 'utf-8') as f:
+        config = json.load(f)
+    config['root'] = os.path.normpath(
+        os.path.join(os.path.dirname(os.path.abspath(filename)),
+                     config.get('root', '.')))
+    config.setdefault('workdir', 'pipeline')
+    names = [stage['name'] for stage in config['stages']]
+    if len(set(names)) != len(names):
+        raise ValueError('The names of the stages have to be unique.')
+    for stage in config['stages']:
+        if stage['kind'] not in STAGE_KINDS:
+            raise ValueError('Unknown kind of stage: %s' % stage['kind'])
+        stage.setdefault('inputs', {})
+        stage.setdefault('params', {})
+    return config
+
+def _dependencies(stage, names):
+    """
+    Get the names of the stages of which a stage uses the output.
+    """
+    return [value for value in stage['inputs'].values()
+            if isinstance(value, str) and value in names]
+
+def stage_order(stages):
+    """
+    Sort the stages so every stage comes after the stages it depends on.
+
+    Parameters
+    ----------
+    stages : list
+        The stages of the pipeline.
+
+    Returns
+    -------
+    ordered : list
+        The sorted stages.
+
+    """
+    names = [stage['name'] for stage in stages]
+    done = []
+    ordered = []
+    while len(ordered) < len(stages):
+        ready = [stage for stage in stages if stage['name'] not in done and
+                 all(dep in done for dep in _dependencies(stage, names))]
+        if len(ready) == 0:
+            raise ValueError('The stages contain a circular dependency.')
+        for stage in ready:
+            done.append(stage['name'])
+            ordered.append(stage)
+    return ordered
+
+def _path(config, path):
+    """
+    Get the absolute path of a path in the configuration.
+    """
+    return os.path.join(config['root'], path)
+
+def _output_path(config, stage):
+    """
+    Get the path of the file with the output of a stage.
+    """
+    return os.path.join(_path(config, config['workdir']),
+                        stage['name'] + '.parquet')
+
+def input_fingerprint(filename):
+    """
+    Get the fingerprint of an input file.
+
+    The attributes, index, projection and encoding of a shapefile are stored
+    in other files with the same name, so the fingerprint of a shapefile
+    includes these files.
+
+    Parameters
+    ----------
+    filename : string
+        Name and path of the file.
+
+    Returns
+    -------
+    fingerprint : string
+        Hexadecimal hash of the file.
+
+    """
+    stem, extension = os.path.splitext(filename)
+    if extension.lower() != '.shp':
+        return file_fingerprint(filename)
+    fingerprints = []
+    for sidecar in SHAPEFILE_SIDECARS:
+        for path in [stem + sidecar, stem + sidecar.upper()]:
+            if os.path.isfile(path):
+                fingerprints.append(sidecar + file_fingerprint(path))
+                break
+    return hashlib.sha1(''.join(fingerprints).encode()).hexdigest()
+
+def stage_key(config, stage, keys):
+    """
+    Get the key of a stage, which changes when the stage has to be rerun.
+
+    The key is a hash of the kind and the parameters of the stage, the
+    fingerprints of its input files (see input_fingerprint) and the keys of
+    the stages it depends on.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration of the pipeline.
+    stage : dict
+        The stage.
+    keys : dict
+        Keys of the stages it depends on.
+
+    Returns
+    -------
+    key : string
+        Hexadecimal hash.
+
+    """
+    inputs = {}
+    for name, value in stage['inputs'].items():
+        if isinstance(value, str) and value in keys:
+            inputs[name] = keys[value]
+        elif isinstance(value, str) and os.path.isfile(_path(config, value)):
+            inputs[name] = input_fingerprint(_path(config, value))
+        else:
+            inputs[name] = value
+    description = json.dumps([stage['kind'], stage['params'], inputs],
+                              sort_keys = True, default = str)
+    return hashlib.sha1(description.encode()).hexdigest()
+
+def _read_output(filename):
+    """
+    Read the output of a stage, as a GeoDataFrame if it contains geometries.
+    """
+    if b'geo' in (pq.read_schema(filename).metadata or {}):
+        return gpd.read_parquet(filename)
+    return pd.read_parquet(filename)
+
+def run_stage(kind, inputs, params, output_path):
+    """
+    Run a single stage and write its output.
+
+    Parameters
+    ----------
+    kind : string
+        Kind of the stage, one of STAGE_KINDS.
+    inputs : dict
+        Inputs of the stage. Outputs of other stages are given as a tuple
+        ('stage', path), these are read first.
+    params : dict
+        Parameters of the stage.
+    output_path : string
+        Path of the file to which the output is written.
+
+    Returns
+    -------
+    output_path : string or list
+        Path of the output, None if the stage has no output, or the list of
+        files written by the stage (export).
+
+    """
+    inputs = {name: _read_output(value[1]) if isinstance(value, tuple)
+              else value for name, value in inputs.items()}
+    output = STAGE_KINDS[kind](**inputs, **params)
+    if output is None or isinstance(output, list):
+        return output
+    output.columns = [str(col) for col in output.columns]
+    # Write to a temporary file first, so no partial outputs are left behind
+    output.to_parquet(output_path + '.tmp')
+    os.replace(output_path + '.tmp', output_path)
+    return output_path
+
+def run_pipeline(config, max_workers = None, force = False):
+    """
+    Run the stages of a pipeline that are outdated.
+
+    Parameters
+    ----------
+    config : dict or string
+        Configuration of the pipeline, or the path of the configuration file.
+    max_workers : int, optional
+        Maximum number of stages run at the same time. If 1, the stages are
+        run one after the other in the current process. The default is None,
+        which uses the number of processors.
+    force : boolean, optional
+        Run all stages, even when they are up to date. The default is False.
+
+    Returns
+    -------
+    executed : list
+        Names of the stages that were run.
+
+    """
+    if isinstance(config, str):
+        config = read_config(config)
+    stages = stage_order(config['stages'])
+    names = [stage['name'] for stage in stages]
+    workdir = _path(config, config['workdir'])
+    os.makedirs(workdir, exist_ok = True)
+    manifest_path = os.path.join(workdir, 'manifest.json')
+    # The manifest holds the key of every stage and the files written by the
+    # stages with a placeholder in their output
+    manifest = {'keys': {}, 'outputs': {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if 'keys' not in manifest:
+            # Manifest of an earlier version, with only the keys
+            manifest = {'keys': manifest, 'outputs': {}}
+    # The keys only depend on the configuration and input files, so the
+    # outdated stages are known before any stage is run
+    keys = {}
+    outdated = []
+    for stage in stages:
+        keys[stage['name']] = stage_key(config, stage, keys)
+        outputs = [_output_path(config, stage)]
+        if stage['kind'] in OUTPUT_PARAMS:
+            outputs = [_path(config, stage['params'][param])
+                       for param in OUTPUT_PARAMS[stage['kind']]]
+        if stage['kind'] == 'export' and 'formats' in stage['params']:
+            outputs = [os.path.splitext(output)[0] + file_format
+                       for output in outputs
+                       for file_format in stage['params']['formats']]
+        # Outputs with a placeholder (one file per city) are checked with the
+        # files written by the previous run
+        if any('{}' in output for output in outputs):
+            outputs = [output for output in outputs if '{}' not in output]
+            outputs += manifest['outputs'].get(stage['name'], [None])
+        if (force or
+                manifest['keys'].get(stage['name']) != keys[stage['name']] or
+                not all(output is not None and os.path.exists(output)
+                        for output in outputs)):
+            outdated.append(stage['name'])
+    def stage_arguments(stage):
+        # Inputs from other stages are passed as ('stage', path) tuples
+        inputs = {}
+        for name, value in stage['inputs'].items():
+            if isinstance(value, str) and value in names:
+                stage_dep = stages[names.index(value)]
+                inputs[name] = ('stage', _output_path(config, stage_dep))
+            elif isinstance(value, str) and os.path.exists(_path(config,
+                                                                 value)):
+                inputs[name] = _path(config, value)
+            else:
+                inputs[name] = value
+        params = dict(stage['params'])
+        for param in OUTPUT_PARAMS.get(stage['kind'], []):
+            params[param] = _path(config, params[param])
+        return (stage['kind'], inputs, params, _output_path(config, stage))
+    def finish(name, written):
+        manifest['keys'][name] = keys[name]
+        if isinstance(written, list):
+            manifest['outputs'][name] = written
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent = 1)
+        print('Finished stage:', name)
+    executed = []
+    pending = [stage for stage in stages if stage['name'] in outdated]
+    if max_workers == 1:
+        for stage in pending:
+            written = run_stage(*stage_arguments(stage))
+            finish(stage['name'], written)
+            executed.append(stage['name'])
+        return executed
+    with ProcessPoolExecutor(max_workers = max_workers) as executor:
+        running = {}
+        while len(pending) > 0 or len(running) > 0:
+            # Submit the stages of which all dependencies are finished
+            for stage in list(pending):
+                waiting = [dep for dep in _dependencies(stage, names)
+                           if dep in outdated and dep not in executed]
+                if len(waiting) == 0:
+                    future = executor.submit(run_stage,
+                                             *stage_arguments(stage))
+                    running[future] = stage['name']
+                    pending.remove(stage)
+            finished, _ = wait(running, return_when = FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                # Raises the error of the stage, if any
+                finish(name, future.result())
+                executed.append(name)
+    return executed
+
+def main(args = None):
+    """
+    Run a pipeline from the command line.
+    """
+    parser = argparse.ArgumentParser(
+        prog = 'python -m censusclean',
+        description = 'Prepare census data with a pipeline configuration.')
+    parser.add_argument('config', help = 'path of the JSON configuration')
+    parser.add_argument('--workers', type = int, default = None,
+                        help = 'maximum number of stages run in parallel')
+    parser.add_argument('--force', action = 'store_true',
+                        help = 'run all stages, also when up to date')
+    args = parser.parse_args(args)
+    executed = run_pipeline(args.config, max_workers = args.workers,
+                            force = args.force)
+    if len(executed) == 0:
+        print('All stages are up to date.')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
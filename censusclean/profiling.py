@@ -0,0 +1,217 @@
+"""
+Functions to measure the time and memory used by the censusclean functions.
+
+The measurements are opt-in: the functions of censusclean are decorated with
+'instrument', which only records a call while a Profiler is active, e.g.
+
+    with Profiler() as profiler:
+        data = clean_census_us(filename)
+        data = cc.split_header(data, sep = '!!', id_cols = ['tract'])
+    print(profiler.summary())
+    profiler.to_json('profile.json')
+
+For every call the wall time, the increase of the peak memory (resident set
+size) of the process and the number of rows and columns of the input and
+output data frames are recorded. Parts of a script can be measured with the
+context manager 'section'.
+"""
+#%% Preamble
+import sys
+import json
+import time
+import functools
+from contextlib import contextmanager
+import pandas as pd
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the memory is not recorded
+    resource = None
+#%% Functions
+# Profilers that are recording, the last one is the innermost
+_ACTIVE = []
+
+def _peak_memory():
+    """
+    Get the peak resident set size of the process in MB, if available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    if sys.platform == 'darwin':
+        return peak/2**20
+    return peak/2**10
+
+def _shape(obj):
+    """
+    Get the number of rows and columns of a data frame or series.
+    """
+    if isinstance(obj, pd.DataFrame):
+        return obj.shape
+    if isinstance(obj, pd.Series):
+        return (len(obj), 1)
+    return (None, None)
+
+class Profiler:
+    """
+    Record the calls of instrumented functions while it is active.
+
+    Attributes
+    ----------
+    records : list
+        A dictionary for every call with the name of the function, its depth
+        (0 for calls that are not made by another recorded call), the wall
+        time in seconds, the increase of the peak memory in MB and the rows
+        and columns of the first input data frame and of the output.
+    """
+    def __init__(self):
+        self.records = []
+        self._depth = 0
+
+    def __enter__(self):
+        _ACTIVE.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _ACTIVE.remove(self)
+        return False
+
+    def to_frame(self):
+        """
+        Get the records as a data frame, with a row for every call.
+        """
+        return pd.DataFrame(self.records,
+                            columns = ['function', 'depth', 'time_s',
+                                       'peak_memory_mb', 'rows_in',
+                                       'cols_in', 'rows_out', 'cols_out'])
+
+    def summary(self):
+        """
+        Summarise the records for every function.
+
+        Returns
+        -------
+        summary : DataFrame
+            Number of calls, total, mean and maximum wall time, the largest
+            increase of the peak memory and the total number of input and
+            output rows of every function, sorted by the total time.
+
+        """
+        records = self.to_frame()
+        summary = records.groupby('function', sort = False).agg(
+            calls = ('time_s', 'size'),
+            total_s = ('time_s', 'sum'),
+            mean_s = ('time_s', 'mean'),
+            max_s = ('time_s', 'max'),
+            peak_memory_mb = ('peak_memory_mb', 'max'),
+            rows_in = ('rows_in', 'sum'),
+            rows_out = ('rows_out', 'sum'))
+        return summary.sort_values('total_s', ascending = False)
+
+    def to_json(self, filename = None):
+        """
+        Export the records as JSON.
+
+        Parameters
+        ----------
+        filename : string, optional
+            Name and path of the file. The default is None, in which case the
+            JSON text is only returned.
+
+        Returns
+        -------
+        text : string
+            The records in JSON format.
+
+        """
+        text = json.dumps({'records': self.records}, indent = 1)
+        if filename is not None:
+            with open(filename, 'w') as f:
+                f.write(text)
+        return text
+
+    def _start(self):
+        """
+        Start recording a call.
+        """
+        self._depth += 1
+        return (_peak_memory(), time.perf_counter())
+
+    def _stop(self, name, started, data_in, output):
+        """
+        Stop recording a call and store its time, memory and sizes.
+        """
+        elapsed = time.perf_counter() - started[1]
+        memory_after = _peak_memory()
+        self._depth -= 1
+        rows_in, cols_in = _shape(data_in)
+        rows_out, cols_out = _shape(output)
+        self.records.append({
+            'function': name, 'depth': self._depth, 'time_s': elapsed,
+            'peak_memory_mb': (None if memory_after is None
+                               else memory_after - started[0]),
+            'rows_in': rows_in, 'cols_in': cols_in,
+            'rows_out': rows_out, 'cols_out': cols_out})
+
+def instrument(function):
+    """
+    Decorate a function so its calls are recorded by the active Profiler.
+
+    Without an active Profiler the function is called directly. The input
+    size is taken from the first data frame or series among the arguments.
+
+    Parameters
+    ----------
+    function : function
+        The function to be instrumented.
+
+    Returns
+    -------
+    wrapper : function
+        The instrumented function.
+
+    """
+    name = '%s.%s' % (function.__module__, function.__qualname__)
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if len(_ACTIVE) == 0:
+            return function(*args, **kwargs)
+        profiler = _ACTIVE[-1]
+        data_in = next((arg for arg in list(args) + list(kwargs.values())
+                        if isinstance(arg, (pd.DataFrame, pd.Series))), None)
+        started = profiler._start()
+        output = None
+        try:
+            output = function(*args, **kwargs)
+        finally:
+            profiler._stop(name, started, data_in, output)
+        return output
+    return wrapper
+
+@contextmanager
+def section(name, data = None):
+    """
+    Record a part of a script as a call of the active Profiler.
+
+    Parameters
+    ----------
+    name : string
+        Name under which the part is recorded.
+    data : DataFrame, optional
+        Input data of the part. The default is None.
+
+    Yields
+    ------
+    None.
+
+    """
+    if len(_ACTIVE) == 0:
+        yield
+        return
+    profiler = _ACTIVE[-1]
+    started = profiler._start()
+    try:
+        yield
+    finally:
+        profiler._stop(name, started, data, None)
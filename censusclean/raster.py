@@ -0,0 +1,323 @@
+"""
+Functions to prepare the satellite images of a city without QGIS.
+
+The functions perform the steps of the QGIS model 'Cleaning_satellite_data':
+
+    1. The city boundaries are reprojected to the project CRS and buffered by
+       a correction distance (native:reprojectlayer, native:buffer).
+    2. The census tracts intersecting the buffered boundaries are selected
+       (native:extractbylocation).
+    3. The satellite image is reprojected to the project CRS
+       (gdal:warpreproject) and clipped to the selected census tracts
+       (gdal:cliprasterbymasklayer).
+
+Step 3 is done block by block: every block of the output is warped from the
+part of the image it covers and masked with the tracts overlapping it, so the
+image is never loaded in memory at once. The blocks are processed in parallel
+by a pool of processes and written by the main process.
+
+The output can be written as a Cloud-Optimized GeoTIFF (COG): a tiled,
+compressed GeoTIFF with internal overviews, so viewers and the tile cache in
+censusclean.tiles only read the tiles of a window at the zoom level needed.
+"""
+#%% Preamble
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import shapely
+import rasterio
+import rasterio.shutil
+from rasterio import features, warp, windows
+from censusclean.profiling import instrument
+#%% Functions
+@instrument
+def select_tracts(tracts, boundaries, crs, correction = 0):
+    """
+    Select the census tracts which intersect the buffered city boundaries.
+
+    Parameters
+    ----------
+    tracts : GeoDataFrame
+        Census tracts.
+    boundaries : GeoDataFrame
+        Boundaries of the city.
+    crs : string or CRS
+        Project CRS in which the boundaries are buffered, e.g. 'EPSG:32616'.
+    correction : float, optional
+        Distance (in units of crs) by which the boundaries are buffered, to
+        correct for deviations between the boundaries and the tracts. The
+        default is 0.
+
+    Returns
+    -------
+    selected : GeoDataFrame
+        The census tracts intersecting the buffered boundaries, in the order
+        and CRS of tracts.
+
+    """
+    # Buffer with 5 segments per quarter circle, as in the QGIS model
+    buffered = boundaries.to_crs(crs).buffer(correction, 5)
+    if tracts.crs is not None and buffered.crs != tracts.crs:
+        buffered = buffered.to_crs(tracts.crs)
+    tree = shapely.STRtree(tracts.geometry.values)
+    _, tract_index = tree.query(buffered.values, predicate = 'intersects')
+    return tracts.iloc[np.unique(tract_index)]
+
+def _block_windows(width, height, block_size):
+    """
+    Divide a grid into square windows of block_size pixels.
+    """
+    return [windows.Window(col, row, min(block_size, width - col),
+                           min(block_size, height - row))
+            for row in range(0, height, block_size)
+            for col in range(0, width, block_size)]
+
+def output_grid(src, crs, mask_bounds = None):
+    """
+    Get the grid of a raster reprojected to a CRS and cropped to a mask.
+
+    The grid is the one gdalwarp chooses by default (about the same number
+    of pixels as the source), cropped to the bounds of the mask.
+
+    Parameters
+    ----------
+    src : DatasetReader
+        The opened source raster.
+    crs : string or CRS
+        Target CRS.
+    mask_bounds : tuple, optional
+        Bounds (left, bottom, right, top) of the mask in the target CRS. The
+        default is None, which does not crop the grid.
+
+    Returns
+    -------
+    transform : Affine
+        Transform of the output grid.
+    width : int
+        Number of columns.
+    height : int
+        Number of rows.
+
+    """
+    transform, width, height = warp.calculate_default_transform(
+        src.crs, crs, src.width, src.height, *src.bounds)
+    if mask_bounds is not None:
+        crop = windows.from_bounds(*mask_bounds, transform = transform)
+        # Extend the window to whole pixels
+        col_off, row_off = np.floor([crop.col_off, crop.row_off])
+        col_end = np.ceil(crop.col_off + crop.width)
+        row_end = np.ceil(crop.row_off + crop.height)
+        crop = windows.Window(col_off, row_off, col_end - col_off,
+                              row_end - row_off)
+        crop = crop.intersection(windows.Window(0, 0, width, height))
+        transform = windows.transform(crop, transform)
+        width, height = int(crop.width), int(crop.height)
+    return transform, width, height
+
+def _warp_block(filename, window, transform, crs, geometries, resampling,
+                nodata):
+    """
+    Warp a block of the output grid from the source raster and set the
+    pixels outside of the geometries to nodata.
+    """
+    block_transform = windows.transform(window, transform)
+    shape = (int(window.height), int(window.width))
+    with rasterio.open(filename) as src:
+        block = np.full((src.count,) + shape, nodata, dtype = src.dtypes[0])
+        if geometries is not None and len(geometries) == 0:
+            # The block lies outside of the mask
+            return window, block
+        # GDAL only reads the part of the source needed for the block
+        warp.reproject(rasterio.band(src, list(range(1, src.count + 1))),
+                       block, src_nodata = src.nodata,
+                       dst_transform = block_transform, dst_crs = crs,
+                       dst_nodata = nodata,
+                       resampling = warp.Resampling[resampling])
+    if geometries is not None:
+        outside = features.geometry_mask(geometries, shape, block_transform)
+        block[:,outside] = nodata
+    return window, block
+
+@instrument
+def write_cog(filename, dst_filename, compress = 'deflate',
+              overview_resampling = 'average', blocksize = 512):
+    """
+    Convert a raster to a Cloud-Optimized GeoTIFF.
+
+    The GDAL COG driver tiles and compresses the raster and adds overviews
+    (halving the resolution until the raster fits in a tile), ordered so a
+    window of an overview is read with a few small requests.
+
+    Parameters
+    ----------
+    filename : string
+        Name and path of the source raster.
+    dst_filename : string
+        Name and path of the COG, which must differ from filename.
+    compress : string, optional
+        Compression of the tiles. The default is 'deflate'.
+    overview_resampling : string, optional
+        Resampling method of the overviews. The default is 'average'; use
+        'nearest' for classes or labels.
+    blocksize : int, optional
+        Width and height in pixels of the tiles. The default is 512.
+
+    Returns
+    -------
+    dst_filename : string
+        Name and path of the COG.
+
+    """
+    if os.path.abspath(filename) == os.path.abspath(dst_filename):
+        raise ValueError('The COG must be written to another file.')
+    # Write to a temporary file first, so no partial files are left
+    rasterio.shutil.copy(filename, dst_filename + '.tmp', driver = 'COG',
+                         compress = compress.upper(),
+                         overview_resampling = overview_resampling.upper(),
+                         blocksize = blocksize)
+    os.replace(dst_filename + '.tmp', dst_filename)
+    return dst_filename
+
+@instrument
+def warp_and_clip(filename, dst_filename, crs, mask = None,
+                  resampling = 'nearest', nodata = None, block_size = 512,
+                  max_workers = None, cog = False, **profile):
+    """
+    Reproject a raster and clip it to a mask layer, block by block.
+
+    Parameters
+    ----------
+    filename : string
+        Name and path of the source raster, e.g. a Sentinel-2 image.
+    dst_filename : string
+        Name and path of the output GeoTIFF.
+    crs : string or CRS
+        Target CRS.
+    mask : GeoDataFrame, optional
+        Polygons to which the raster is clipped. The output is cropped to
+        their bounds and the pixels outside of them are set to nodata. The
+        default is None, which only reprojects the raster.
+    resampling : string, optional
+        Resampling method, a name of rasterio.warp.Resampling. The default is
+        'nearest', as in the QGIS model.
+    nodata : float, optional
+        Value of the pixels outside of the raster or the mask. The default is
+        None, which uses the nodata value of the source, or 0.
+    block_size : int, optional
+        Width and height in pixels of the blocks that are processed at once.
+        The default is 512.
+    max_workers : int, optional
+        Number of processes. If 1, the blocks are processed in the current
+        process. The default is None, which uses the number of processors.
+    cog : bool, optional
+        If True, the output is written as a Cloud-Optimized GeoTIFF with
+        overviews, see write_cog. The default is False.
+    **profile :
+        Options of the output file, e.g. compress = 'deflate'. If cog is
+        True, these are the options of the intermediate GeoTIFF.
+
+    Returns
+    -------
+    dst_filename : string
+        Name and path of the output GeoTIFF.
+
+    """
+    if cog:
+        # Warp to an intermediate GeoTIFF, which is converted to a COG
+        temp_filename = dst_filename + '.warp.tif'
+        try:
+            warp_and_clip(filename, temp_filename, crs, mask, resampling,
+                          nodata, block_size, max_workers, **profile)
+            write_cog(temp_filename, dst_filename)
+        finally:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+        return dst_filename
+    with rasterio.open(filename) as src:
+        if nodata is None:
+            nodata = src.nodata if src.nodata is not None else 0
+        geometries = None
+        mask_bounds = None
+        if mask is not None:
+            geometries = mask.to_crs(crs).geometry.values
+            mask_bounds = tuple(shapely.total_bounds(geometries))
+        transform, width, height = output_grid(src, crs, mask_bounds)
+        dst_profile = src.profile.copy()
+        descriptions = src.descriptions
+    dst_profile.update(driver = 'GTiff', crs = crs, transform = transform,
+                       width = width, height = height, nodata = nodata,
+                       tiled = True, blockxsize = 256, blockysize = 256)
+    dst_profile.update(profile)
+    blocks = _block_windows(width, height, block_size)
+    # Every block only gets the geometries overlapping it
+    block_geometries = [None]*len(blocks)
+    if geometries is not None:
+        tree = shapely.STRtree(geometries)
+        block_bounds = np.array([windows.bounds(window, transform)
+                                 for window in blocks])
+        block_index, geometry_index = tree.query(
+            shapely.box(*block_bounds.T), predicate = 'intersects')
+        block_geometries = [geometries[geometry_index[block_index == i]]
+                            for i in range(len(blocks))]
+    arguments = [(filename, window, transform, crs, block_geometry,
+                  resampling, nodata)
+                 for window, block_geometry in zip(blocks, block_geometries)]
+    with rasterio.open(dst_filename, 'w', **dst_profile) as dst:
+        # Keep the band names (e.g. B4_NIR) for the selection of bands
+        dst.descriptions = descriptions
+        if max_workers == 1:
+            for argument in arguments:
+                window, block = _warp_block(*argument)
+                dst.write(block, window = window)
+            return dst_filename
+        with ProcessPoolExecutor(max_workers = max_workers) as executor:
+            # The blocks are submitted in batches, so only a limited number
+            # of blocks is kept in memory
+            batch_size = 4*(max_workers or os.cpu_count() or 1)
+            for start in range(0, len(arguments), batch_size):
+                batch = arguments[start:start + batch_size]
+                for window, block in executor.map(_warp_block, *zip(*batch)):
+                    dst.write(block, window = window)
+    return dst_filename
+
+@instrument
+def clean_satellite_image(filename, dst_filename, tracts, boundaries, crs,
+                          correction = 0, cog = True, **kwargs):
+    """
+    Prepare a satellite image of a city, as the QGIS model
+    'Cleaning_satellite_data'.
+
+    The census tracts intersecting the buffered city boundaries are selected
+    and the image is reprojected to the project CRS and clipped to them.
+
+    Parameters
+    ----------
+    filename : string
+        Name and path of the satellite image.
+    dst_filename : string
+        Name and path of the clipped image.
+    tracts : GeoDataFrame
+        Census tracts.
+    boundaries : GeoDataFrame
+        Boundaries of the city.
+    crs : string or CRS
+        Project CRS, e.g. 'EPSG:32616'.
+    correction : float, optional
+        Distance (in units of crs) by which the boundaries are buffered. The
+        default is 0.
+    cog : bool, optional
+        If True, the clipped image is written as a Cloud-Optimized GeoTIFF.
+        The default is True.
+    **kwargs :
+        Arguments passed to warp_and_clip (e.g. max_workers, block_size).
+
+    Returns
+    -------
+    selected : GeoDataFrame
+        The selected census tracts.
+
+    """
+    selected = select_tracts(tracts, boundaries, crs, correction)
+    warp_and_clip(filename, dst_filename, crs, mask = selected, cog = cog,
+                  **kwargs)
+    return selected
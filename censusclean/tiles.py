@@ -0,0 +1,175 @@
+"""
+A cache of raster tiles for repeated window reads.
+
+The zonal statistics and the maps read the same parts of an image many
+times, often at a lower resolution. TileCache reads windows tile by tile,
+using the internal tiles of the raster (see raster.write_cog), and keeps the
+most recently used tiles in memory up to a maximum size. A window of an
+overview of a Cloud-Optimized GeoTIFF then only reads the few tiles it
+overlaps, and a repeated read of the same area does not read the file again.
+"""
+#%% Preamble
+from collections import OrderedDict
+import numpy as np
+import rasterio
+from rasterio import windows
+#%% Functions
+class TileCache:
+    """
+    Read windows of rasters through a cache of tiles with LRU eviction.
+
+    Parameters
+    ----------
+    max_mb : float, optional
+        Maximum size of the cached tiles in MB. When it is exceeded, the
+        least recently used tiles are removed. The default is 64.
+
+    Attributes
+    ----------
+    hits : int
+        Number of tiles read from the cache.
+    misses : int
+        Number of tiles read from the file.
+    """
+    def __init__(self, max_mb = 64):
+        self.max_bytes = max_mb*2**20
+        self.hits = 0
+        self.misses = 0
+        self._tiles = OrderedDict()
+        self._size = 0
+        self._datasets = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def __len__(self):
+        return len(self._tiles)
+
+    @property
+    def nbytes(self):
+        """
+        Size of the cached tiles in bytes.
+        """
+        return self._size
+
+    def close(self):
+        """
+        Close the opened rasters and empty the cache.
+        """
+        for src in self._datasets.values():
+            src.close()
+        self._datasets = {}
+        self._tiles = OrderedDict()
+        self._size = 0
+
+    def dataset(self, filename, overview_level = None):
+        """
+        Get the opened raster of an overview level.
+
+        Parameters
+        ----------
+        filename : string
+            Name and path of the raster.
+        overview_level : int, optional
+            Overview to read, 0 for the first (half the resolution). The
+            default is None, which reads the full resolution.
+
+        Returns
+        -------
+        src : DatasetReader
+            The raster, which stays open until the cache is closed.
+
+        """
+        key = (filename, overview_level)
+        if key not in self._datasets:
+            if overview_level is None:
+                self._datasets[key] = rasterio.open(filename)
+            else:
+                self._datasets[key] = rasterio.open(
+                    filename, overview_level = overview_level)
+        return self._datasets[key]
+
+    def _tile(self, src, key, window):
+        """
+        Get a tile from the cache, or read it and add it to the cache.
+        """
+        if key in self._tiles:
+            self._tiles.move_to_end(key)
+            self.hits += 1
+            return self._tiles[key]
+        self.misses += 1
+        tile = src.read(window = window, masked = True)
+        tile_bytes = tile.data.nbytes + np.ma.getmaskarray(tile).nbytes
+        self._tiles[key] = tile
+        self._size += tile_bytes
+        while self._size > self.max_bytes and len(self._tiles) > 1:
+            _, removed = self._tiles.popitem(last = False)
+            self._size -= (removed.data.nbytes +
+                           np.ma.getmaskarray(removed).nbytes)
+        return tile
+
+    def read(self, filename, window, overview_level = None, indexes = None):
+        """
+        Read a window of a raster through the cache.
+
+        Parameters
+        ----------
+        filename : string
+            Name and path of the raster.
+        window : Window
+            Window in pixels of the overview level.
+        overview_level : int, optional
+            Overview to read, 0 for the first (half the resolution). The
+            default is None, which reads the full resolution.
+        indexes : int or list, optional
+            Band(s) to return, as in DatasetReader.read. The default is None,
+            which returns all bands.
+
+        Returns
+        -------
+        data : MaskedArray
+            The window with the nodata pixels masked, with shape (bands, rows,
+            columns), or (rows, columns) if indexes is a single band.
+
+        """
+        src = self.dataset(filename, overview_level)
+        window = window.round_lengths().round_offsets()
+        window = window.intersection(windows.Window(0, 0, src.width,
+                                                    src.height))
+        tile_height, tile_width = src.block_shapes[0]
+        row_off, col_off = int(window.row_off), int(window.col_off)
+        height, width = int(window.height), int(window.width)
+        data = np.ma.masked_all((src.count, height, width),
+                                dtype = src.dtypes[0])
+        for tile_row in range(row_off//tile_height,
+                              (row_off + height - 1)//tile_height + 1):
+            for tile_col in range(col_off//tile_width,
+                                  (col_off + width - 1)//tile_width + 1):
+                tile_window = windows.Window(
+                    tile_col*tile_width, tile_row*tile_height,
+                    min(tile_width, src.width - tile_col*tile_width),
+                    min(tile_height, src.height - tile_row*tile_height))
+                tile = self._tile(src, (filename, overview_level, tile_row,
+                                        tile_col), tile_window)
+                # Part of the tile that lies in the window
+                part = window.intersection(tile_window)
+                rows = slice(int(part.row_off) - row_off,
+                             int(part.row_off + part.height) - row_off)
+                cols = slice(int(part.col_off) - col_off,
+                             int(part.col_off + part.width) - col_off)
+                tile_rows = slice(int(part.row_off) - tile_row*tile_height,
+                                  int(part.row_off + part.height) -
+                                  tile_row*tile_height)
+                tile_cols = slice(int(part.col_off) - tile_col*tile_width,
+                                  int(part.col_off + part.width) -
+                                  tile_col*tile_width)
+                data[:, rows, cols] = tile[:, tile_rows, tile_cols]
+        if indexes is None:
+            return data
+        if isinstance(indexes, int):
+            return data[indexes - 1]
+        return data[[index - 1 for index in indexes]]
@@ -0,0 +1,227 @@
+"""
+Functions to summarise satellite images (e.g. the NDVI) per census tract.
+
+The census tracts are rasterized once onto the grid of the images, giving a
+label array with the number of the tract of every pixel. The statistics of
+all tracts are then computed together with np.bincount, while the image is
+read window by window. The label arrays are cached on disk, so images of
+other dates on the same grid reuse them.
+
+The median and percentiles are computed from a histogram of every tract, so
+they are exact up to the width of a bin (0.01 for the NDVI by default).
+"""
+#%% Preamble
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+import shapely
+import rasterio
+from rasterio import features, windows
+from censusclean.profiling import instrument
+#%% Functions
+def _labels_key(geometries, transform, shape, crs):
+    """
+    Get a hash of the geometries and the grid of a label array.
+    """
+    key = hashlib.sha1()
+    for part in shapely.to_wkb(geometries):
+        key.update(part)
+    key.update(repr((tuple(transform), tuple(shape), str(crs))).encode())
+    return key.hexdigest()[:16]
+
+@instrument
+def tract_labels(tracts, filename, cache_dir = '.censusclean_cache'):
+    """
+    Rasterize census tracts onto the grid of a raster.
+
+    A pixel gets the number of the tract (its position in tracts plus one)
+    that contains its center, or 0 if it lies outside of all tracts.
+
+    Parameters
+    ----------
+    tracts : GeoDataFrame
+        Census tracts.
+    filename : string
+        Name and path of a raster with the grid of the images.
+    cache_dir : string, optional
+        Folder in which the label array is stored. The default is
+        '.censusclean_cache'. If None, the labels are not cached.
+
+    Returns
+    -------
+    labels : ndarray
+        Label array with the shape of the raster (memory mapped when read
+        from the cache).
+
+    """
+    with rasterio.open(filename) as src:
+        transform, shape, crs = src.transform, src.shape, src.crs
+    geometries = tracts.to_crs(crs).geometry.values
+    if cache_dir is not None:
+        entry = os.path.join(cache_dir, 'labels-%s.npy' %
+                             _labels_key(geometries, transform, shape, crs))
+        if os.path.exists(entry):
+            return np.load(entry, mmap_mode = 'r')
+    dtype = 'int32' if len(geometries) < 2**31 - 1 else 'int64'
+    labels = features.rasterize(
+        zip(geometries, np.arange(1, len(geometries) + 1)),
+        out_shape = shape, transform = transform, fill = 0, dtype = dtype)
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok = True)
+        # Write to a temporary file first, so no partial entries are left
+        with open(entry + '.tmp', 'wb') as f:
+            np.save(f, labels)
+        os.replace(entry + '.tmp', entry)
+    return labels
+
+def ndvi(nir, red):
+    """
+    Compute the normalized difference vegetation index.
+
+    Parameters
+    ----------
+    nir : ndarray
+        Near infrared band.
+    red : ndarray
+        Red band.
+
+    Returns
+    -------
+    ndvi : ndarray
+        (nir - red)/(nir + red), NaN where both bands are 0.
+
+    """
+    nir = nir.astype('float32')
+    red = red.astype('float32')
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return (nir - red)/(nir + red)
+
+def _histogram_percentiles(histogram, edges, q):
+    """
+    Compute percentiles from a histogram per row, interpolating linearly
+    within the bins.
+    """
+    counts = histogram.sum(axis = 1)
+    cumulative = histogram.cumsum(axis = 1)
+    target = counts*q
+    # First bin in which the cumulative count reaches the target
+    bin_index = np.minimum((cumulative < target[:,None]).sum(axis = 1),
+                           histogram.shape[1] - 1)
+    rows = np.arange(len(histogram))
+    before = cumulative[rows, bin_index] - histogram[rows, bin_index]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        fraction = np.clip((target - before)/histogram[rows, bin_index], 0, 1)
+    width = edges[1] - edges[0]
+    result = edges[bin_index] + fraction*width
+    result[counts == 0] = np.nan
+    return result
+
+@instrument
+def zonal_statistics(filename, labels, tracts = None, col_id = None,
+                     bands = (4, 3), percentiles = (10, 25, 75, 90),
+                     green_threshold = 0.3, value_range = (-1, 1),
+                     bins = 200, block_size = 1024, tiles = None):
+    """
+    Compute statistics of the NDVI (or another band) for every census tract.
+
+    Parameters
+    ----------
+    filename : string
+        Name and path of the image.
+    labels : ndarray
+        Label array of the tracts on the grid of the image, see tract_labels.
+    tracts : GeoDataFrame, optional
+        The census tracts used for the labels. The default is None.
+    col_id : string, optional
+        Column of tracts with the identifiers, which is added to the output.
+        The default is None.
+    bands : tuple or int, optional
+        Numbers of the near infrared and red bands, from which the NDVI is
+        computed. The default is (4, 3), the bands 'B4_NIR' and 'B3_red' of
+        the exported Sentinel-2 images. If a single number is given, the
+        values of that band are used (e.g. an NDVI image).
+    percentiles : tuple, optional
+        Percentiles computed besides the median. The default is
+        (10, 25, 75, 90).
+    green_threshold : float, optional
+        Pixels with a value above the threshold count as green. The default
+        is 0.3.
+    value_range : tuple, optional
+        Range of the histograms used for the percentiles. The default is
+        (-1, 1), the range of the NDVI.
+    bins : int, optional
+        Number of bins of the histograms. The default is 200.
+    block_size : int, optional
+        Width and height in pixels of the windows that are read at once. The
+        default is 1024.
+    tiles : TileCache, optional
+        Cache through which the image is read, see censusclean.tiles, so
+        repeated statistics of the same image (e.g. for other tracts) do not
+        read the file again. The default is None, which reads the file.
+
+    Returns
+    -------
+    statistics : DataFrame
+        A row for every tract with the number of valid pixels, the mean, the
+        median, the percentiles ('p25', ...) and the fraction of green
+        pixels. Tracts without valid pixels have missing statistics.
+
+    """
+    n_tracts = int(labels.max()) if tracts is None else len(tracts)
+    n_labels = n_tracts + 1
+    counts = np.zeros(n_labels)
+    sums = np.zeros(n_labels)
+    green = np.zeros(n_labels)
+    histogram = np.zeros(n_labels*bins)
+    edges = np.linspace(value_range[0], value_range[1], bins + 1)
+    bin_scale = bins/(value_range[1] - value_range[0])
+    indexes = bands if isinstance(bands, int) else list(bands)
+    with rasterio.open(filename) as src:
+        if src.shape != labels.shape:
+            raise ValueError('The labels do not have the shape of the image.')
+        for row in range(0, src.height, block_size):
+            for col in range(0, src.width, block_size):
+                window = windows.Window(col, row,
+                                        min(block_size, src.width - col),
+                                        min(block_size, src.height - row))
+                label_block = np.asarray(labels[windows.window_index(window)])
+                if label_block.max() == 0:
+                    # The window lies outside of all tracts
+                    continue
+                if tiles is not None:
+                    data = tiles.read(filename, window, indexes = indexes)
+                else:
+                    data = src.read(indexes, window = window, masked = True)
+                if isinstance(bands, int):
+                    values = data.astype('float32').filled(np.nan)
+                else:
+                    values = ndvi(data[0], data[1])
+                    values = np.where(np.ma.getmaskarray(data).any(axis = 0),
+                                      np.nan, values)
+                valid = (label_block > 0) & np.isfinite(values)
+                label_valid = label_block[valid]
+                values = values[valid]
+                counts += np.bincount(label_valid, minlength = n_labels)
+                sums += np.bincount(label_valid, values, minlength = n_labels)
+                green += np.bincount(label_valid, values > green_threshold,
+                                     minlength = n_labels)
+                bin_index = np.clip(((values - value_range[0])*bin_scale)
+                                    .astype('int64'), 0, bins - 1)
+                histogram += np.bincount(label_valid*bins + bin_index,
+                                         minlength = n_labels*bins)
+    histogram = histogram.reshape(n_labels, bins)[1:]
+    counts = counts[1:]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        statistics = pd.DataFrame({'pixels': counts.astype('int64'),
+                                   'mean': sums[1:]/counts})
+        statistics['median'] = _histogram_percentiles(histogram, edges, 0.5)
+        for q in percentiles:
+            statistics['p%g' % q] = _histogram_percentiles(histogram, edges,
+                                                           q/100)
+        statistics['green_fraction'] = green[1:]/counts
+    if tracts is not None:
+        statistics.index = tracts.index
+        if col_id is not None:
+            statistics.insert(0, col_id, tracts[col_id].to_numpy())
+    return statistics